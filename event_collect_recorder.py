@@ -2,8 +2,12 @@
 """ Provides implementation of the class EventCollectRecorder, an event recoreder that created as
 simple, space separated table from single events """
 
+import bisect
+import collections
 import copy
 import logging
+import os
+from time import monotonic
 
 class EventCollectRecorder():
     """EventCollectRecorder implements an recorder that logs events into a regular text file. On
@@ -21,23 +25,92 @@ class EventCollectRecorder():
     cache. As long as event are in the cache they may be also overwritten with updated data.
     Also, a grouping of events can be achieved when the events are reported using identical
     timestamp.
+    Optionally, an append-only journal is kept next to the log file. Every accepted event and
+    every registration is written to the journal before it enters the cache, so events still in
+    the cache survive a crash of the process. To keep the journal lightweight, it is synced to
+    disk at most once per JOURNAL_SYNC_INTERVAL seconds (group commit), so a power cut loses at
+    most the events accepted since the last sync. On restart the last row of the log is read by
+    seeking from its end and the journal is replayed on top of it once all of its sources are
+    registered. Registered sources therefore continue with their last known state instead of the
+    registration default.
+    The lateness of events (how far they are behind the most recent event) is tracked per
+    source. In adaptive mode the cache duration follows the given percentile of the observed
+    lateness, bounded by cache_duration and max_cache_duration. Events that are still too late
+    are handled according to the late policy:
+        "raise"   -- Raise an exception (default)
+        "drop"    -- Discard the event
+        "clamp"   -- Move the event to the oldest entry still in the cache
+        "correct" -- Write the event to a separate correction file <path>.late
+    Listeners may be added to get informed about each accepted event and about each row written
+    to the log file, e.g. to forward them to live consumers. Listeners are called synchronously
+    and therefore shall return quickly, exceptions raised by listeners are logged and ignored.
+    Beside the log file, rows may be stored in further storage sinks (see storage_sink).
     """
 
-    def __init__(self, path, cache_duration=2):
+    JOURNAL_LIMIT = 64 * 1024
+    JOURNAL_SYNC_INTERVAL = 1.
+    LATENESS_HISTORY = 1000
+    LATE_POLICIES = ("raise", "drop", "clamp", "correct")
+
+    def __init__(self, path, cache_duration=2, journal=False, adaptive=False,
+                 late_policy="raise", late_percentile=99, max_cache_duration=60):
+        if late_policy not in self.LATE_POLICIES:
+            raise Exception("Unknown late policy {}, expected one of {}"
+                            .format(late_policy, self.LATE_POLICIES))
+        self._path = path
+        self._adaptive = adaptive
+        self._late_policy = late_policy
+        self._late_percentile = late_percentile
+        self._min_cache_duration = cache_duration
+        self._max_cache_duration = max_cache_duration
+        self._lateness = {}
+        self._late_stream = None
+        self._event_listeners = []
+        self._row_listeners = []
+        self._storage_sinks = []
+        self._restored = {}
+        self._replay = []
+        self._replay_sources = set()
+        self._journal = None
+        self._journal_path = path + ".journal" if journal else None
+        self._journal_layout = []
+        self._journal_pending = []
+        self._journal_sync_time = 0.
+        if self._journal_path:
+            self._restore(path)
         self._ostream = open(path, "a", encoding="utf-8")
         self._cache_duration = cache_duration
         self._head = {"Time" : 0}
         self._tail = copy.copy(self._head)
         self._cache = []
+        # Sources with an event at the time of the _cache entry of same index
+        self._cache_sources = []
         self._source_from_pos_lookup = ["Time"]
+        if self._journal_path:
+            self._compact_journal()
 
     def __del__(self):
         try:
-            self._dump_events()
-            self._ostream.close()
+            self.close()
         except BaseException:
             pass
 
+    def close(self):
+        """ Write all cached events to the log file and close it. The journal is compacted to
+        the registrations, so a restart still restores the last row of the log."""
+        if self._ostream.closed:
+            return
+        self._dump_events()
+        if self._journal:
+            self._sync(self._ostream)
+            self._compact_journal()
+            self._journal.close()
+        if self._late_stream:
+            self._late_stream.close()
+        for sink in self._storage_sinks:
+            sink.close()
+        self._ostream.close()
+
     def register_event_source(self, source, pos, default):
         """ Register a new event from the given source to be printed as pos culumn in the text
         lines. Source and pos has to be unique for each event. Until the event occures the first
@@ -62,7 +135,15 @@ class EventCollectRecorder():
             raise Exception("Event registration for source {} failed: Source already in use"
                             .format(source))
         self._source_from_pos_lookup[pos] = source
+        if self._journal:
+            self._journal_layout.append((pos, source))
+            self._write_journal("R\t{}\t{}\n".format(pos, source))
+        for sink in self._storage_sinks:
+            sink.set_columns(self.column_names())
+        default = self._restored.get(source, default)
         self._propagate_event(source, -1, default)
+        if self._replay and self._replay_sources.issubset(self._head):
+            self._replay_journal()
 
     def create_event(self, source, time, event):
         """ Set the state of the event from source source to event. Use time to locate the event
@@ -79,21 +160,144 @@ class EventCollectRecorder():
         if source not in self._head:
             raise Exception("Event creation failed: Source {} is not registered"
                             .format(source))
-        if time < self._head["Time"] - self._cache_duration:
+        if self._replay:
+            self._replay_journal()
+        self._track_lateness(source, time)
+        # Rows up to the tail are written already, so events at their time are too late even if
+        # the cache duration grew in the meantime
+        try:
+            if (time < self._head["Time"] - self._cache_duration or
+                    time <= self._tail["Time"]):
+                time = self._handle_late_event(source, time, event)
+        finally:
+            # Adapt only after the decision, the event must not widen the window for itself
+            if self._adaptive:
+                self._adapt_cache_duration()
+        if time is None:
+            return
+        if self._journal:
+            self._journal_pending.append((time, source, event))
+            self._write_journal("E\t{!r}\t{}\t{}\n".format(time, source, event))
+        self._create_event(source, time, event)
+        if self._event_listeners:
+            self._notify(self._event_listeners, time, source, event)
+
+    def add_storage_sink(self, sink):
+        """ Add a StorageSink that gets each row written to the log file. The sink is closed
+        along with the recorder"""
+        sink.set_columns(self.column_names())
+        self._storage_sinks.append(sink)
+
+    def add_event_listener(self, callback):
+        """ Add a callback that is called as callback(time, source, event) for each event
+        accepted by create_event"""
+        self._event_listeners.append(callback)
+
+    def add_row_listener(self, callback):
+        """ Add a callback that is called as callback(text) for each row written to the log
+        file, text is the row as written without line break"""
+        self._row_listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """ Remove a callback added by add_event_listener or add_row_listener"""
+        for listeners in (self._event_listeners, self._row_listeners):
+            if callback in listeners:
+                listeners.remove(callback)
+
+    def column_names(self):
+        """ Return the names of the columns as printed in the rows, starting with "Time" """
+        return [source for source in self._source_from_pos_lookup if source]
+
+    @staticmethod
+    def _notify(listeners, *args):
+        for callback in listeners:
+            try:
+                callback(*args)
+            except Exception:
+                logging.exception("Listener %s failed", callback)
+
+    def lateness_statistics(self):
+        """ Return the observed lateness of events as dictionary with an entry per source and the
+        current cache duration in the entry "cache_duration". Per source there is given:
+        count      -- Number of events received
+        late       -- Number of events that arrived outside of the cache
+        max        -- Maximum lateness in seconds
+        percentile -- Lateness in seconds at the configured percentile of recent events
+        """
+        result = {"cache_duration" : self._cache_duration}
+        for source, stats in self._lateness.items():
+            result[source] = {"count" : stats["count"],
+                              "late" : stats["late"],
+                              "max" : stats["max"],
+                              "percentile" : self._percentile(stats["ordered"])}
+        return result
+
+    def _percentile(self, ordered):
+        if not ordered:
+            return 0.
+        index = int(round(self._late_percentile / 100. * (len(ordered) - 1)))
+        return ordered[index]
+
+    def _track_lateness(self, source, time):
+        """Record the lateness of an event. Beside the history in arrival order, the history is
+        kept sorted, so the percentile is looked up without sorting on each event"""
+        lateness = max(self._head["Time"] - time, 0.)
+        stats = self._lateness.get(source)
+        if stats is None:
+            stats = {"count" : 0, "late" : 0, "max" : 0.,
+                     "history" : collections.deque(), "ordered" : []}
+            self._lateness[source] = stats
+        stats["count"] += 1
+        stats["max"] = max(stats["max"], lateness)
+        history = stats["history"]
+        ordered = stats["ordered"]
+        if len(history) == self.LATENESS_HISTORY:
+            del ordered[bisect.bisect_left(ordered, history.popleft())]
+        history.append(lateness)
+        bisect.insort(ordered, lateness)
+
+    def _adapt_cache_duration(self):
+        window = max(self._percentile(val["ordered"]) for val in self._lateness.values())
+        self._cache_duration = min(max(window, self._min_cache_duration),
+                                   self._max_cache_duration)
+
+    def _handle_late_event(self, source, time, event):
+        """Apply the late policy to an event outside of the cache. Returns the time the event
+        shall be created at or None if the event is not to be created"""
+        self._lateness[source]["late"] += 1
+        if self._late_policy == "raise":
             raise Exception("Event creation failed: Time ({}) outside of _cache ({})"
                             .format(time, self._cache))
+        logging.warning("Late event time:source:event %f:%s:%s handled by policy %s",
+                        time, source, str(event), self._late_policy)
+        if self._late_policy == "clamp":
+            # The oldest entry in the cache is the earliest time not written yet. If the source
+            # has a more recent event there already, the late event must not replace it.
+            if self._cache and source not in self._cache_sources[0]:
+                return self._cache[0]["Time"]
+            logging.warning("No cache entry to clamp to, event dropped")
+        if self._late_policy == "correct":
+            if not self._late_stream:
+                self._late_stream = open(self._path + ".late", "a", encoding="utf-8")
+            self._late_stream.write("{} {} {}\n".format(time, source, event))
+            self._late_stream.flush()
+        return None
+
+    def _create_event(self, source, time, event, dump=True):
         if time > self._head["Time"]:
-            self._append_event(source, time, event)
+            self._append_event(source, time, event, dump)
         else:
             self._insert_event(source, time, event)
-        logging.debug("%s @ %f -> %s", source, time, str(self._cache))
+        logging.debug("%s @ %f -> %s", source, time, self._cache)
 
-    def _append_event(self, source, time, event):
+    def _append_event(self, source, time, event, dump=True):
         logging.debug("Inserting event at head")
         self._head[source] = event
         self._head["Time"] = time
         self._cache.append(copy.copy(self._head))
-        self._dump_events(time - self._cache_duration)
+        self._cache_sources.append({source})
+        if dump:
+            self._dump_events(time - self._cache_duration)
 
     def _insert_event(self, source, time, event):
         cur_num = -1
@@ -114,7 +318,9 @@ class EventCollectRecorder():
                 new_event = copy.copy(self._tail)
             new_event["Time"] = time
             self._cache.insert(cur_num, new_event)
+            self._cache_sources.insert(cur_num, set())
         self._propagate_event(source, cur_num, event)
+        self._cache_sources[cur_num].add(source)
 
     def _propagate_event(self, source, cache_entry_num, new_message):
         """Propagate event change from tail through _cache until head.
@@ -122,18 +328,17 @@ class EventCollectRecorder():
         Propagation will also propagate missing sources in the _cache
         """
         if -1 == cache_entry_num:
-            current_message = self._tail.get(source)
             self._tail[source] = new_message
             cache_entry_num = 0
         else:
-            current_message = self._cache[cache_entry_num].get(source)
-        # Propagate in _cache as long as event in _cache is the same. A different
-        # event indicates that there has been already an event creation for the
-        # time of the _cache entry
-        for current in self._cache[cache_entry_num:]:
-            if current.get(source) == current_message:
-                current[source] = new_message
-            else: break
+            self._cache[cache_entry_num][source] = new_message
+            cache_entry_num += 1
+        # Propagate in _cache until an entry with an event of the source. Comparing values
+        # instead is not sufficient, as a later event may repeat the previous value
+        for num in range(cache_entry_num, len(self._cache)):
+            if source in self._cache_sources[num]:
+                break
+            self._cache[num][source] = new_message
         else:
             self._head[source] = new_message
 
@@ -144,14 +349,128 @@ class EventCollectRecorder():
                 self._tail = event
                 text = self._format_event(event)
                 self._ostream.write(text + '\n')
+                if self._row_listeners:
+                    self._notify(self._row_listeners, text)
+                for sink in self._storage_sinks:
+                    sink.write([event[source] for source in self._source_from_pos_lookup
+                                if source])
             else: break
         else:
             num += 1
         if num:
             self._cache = self._cache[num:]
+            self._cache_sources = self._cache_sources[num:]
             self._ostream.flush()
+            if self._journal and self._journal.tell() > self.JOURNAL_LIMIT:
+                self._sync(self._ostream)
+                self._compact_journal()
         return num
 
+    @staticmethod
+    def _sync(stream):
+        stream.flush()
+        os.fsync(stream.fileno())
+
+    def _write_journal(self, text):
+        self._journal.write(text)
+        now = monotonic()
+        if now - self._journal_sync_time >= self.JOURNAL_SYNC_INTERVAL:
+            self._sync(self._journal)
+            self._journal_sync_time = now
+        else:
+            self._journal.flush()
+
+    def _compact_journal(self):
+        """Rewrite the journal with the registrations and the events not yet written to the log
+        file. The new journal replaces the old one atomically."""
+        self._journal_pending = [entry for entry in self._journal_pending
+                                 if entry[0] > self._tail["Time"]]
+        tmp_path = self._journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as stream:
+            for pos, source in self._journal_layout:
+                stream.write("R\t{}\t{}\n".format(pos, source))
+            for time, source, event in self._journal_pending:
+                stream.write("E\t{!r}\t{}\t{}\n".format(time, source, event))
+            self._sync(stream)
+        os.replace(tmp_path, self._journal_path)
+        if self._journal:
+            self._journal.close()
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+    def _restore(self, path):
+        """Restore the state of the last run from the last row of the log file and the journal.
+        The restored values are applied as sources get registered."""
+        row = self._read_last_row(path)
+        layout = {}
+        replay = []
+        try:
+            with open(self._journal_path, "r", encoding="utf-8") as stream:
+                for line in stream:
+                    fields = line.rstrip("\n").split("\t")
+                    # A line cut off by a power loss is ignored
+                    if not line.endswith("\n"):
+                        break
+                    if fields[0] == "R" and len(fields) == 3:
+                        layout[int(fields[1])] = fields[2]
+                    elif fields[0] == "E" and len(fields) == 4:
+                        replay.append((float(fields[1]), fields[2], fields[3]))
+        except FileNotFoundError:
+            pass
+        row_time = float("-inf")
+        if row and layout:
+            # Empty positions are not printed, so columns follow the sorted positions
+            columns = ["Time"] + [layout[pos] for pos in sorted(layout) if pos > 0]
+            if len(columns) == len(row):
+                self._restored = dict(zip(columns[1:], row[1:]))
+                row_time = float(row[0])
+            else:
+                logging.warning("Last row of %s does not match journal layout, not restored",
+                                path)
+        for time, source, event in sorted(replay, key=lambda entry: entry[0]):
+            if time > row_time:
+                self._replay.append((time, source, event))
+                self._journal_pending.append((time, source, event))
+        self._replay_sources = set(layout.values())
+        logging.info("Restored %d sources and %d journal events from last run",
+                     len(self._restored), len(self._replay))
+
+    def _replay_journal(self):
+        """Create the events of the journal of the last run in time order. This is done once all
+        sources of the journal are registered or at the first new event, whatever comes first.
+        No rows are written during the replay, as the journal may cover a cache window wider
+        than the current one. They are written along with the next event instead."""
+        replay, self._replay = self._replay, []
+        for time, source, event in replay:
+            if source in self._head:
+                self._create_event(source, time, event, dump=False)
+            else:
+                logging.warning("Journal event %f:%s:%s dropped, source not registered",
+                                time, source, str(event))
+
+    @staticmethod
+    def _read_last_row(path, block_size=4096):
+        """Read the last complete row of the log file by seeking from its end. An incomplete
+        last row, e.g. left by a power cut, is truncated from the file."""
+        try:
+            stream = open(path, "rb+")
+        except FileNotFoundError:
+            return None
+        with stream:
+            end = stream.seek(0, os.SEEK_END)
+            pos = end
+            data = b""
+            while pos > 0 and data.count(b"\n") < 2:
+                step = min(block_size, pos)
+                pos -= step
+                stream.seek(pos)
+                data = stream.read(step) + data
+            if not data.endswith(b"\n"):
+                cut = data.rfind(b"\n") + 1
+                stream.truncate(pos + cut)
+                data = data[:cut]
+            lines = data.splitlines()
+            return lines[-1].decode("utf-8").split() if lines else None
+
     def _format_event(self, event):
         text = ""
         for source in self._source_from_pos_lookup:
@@ -0,0 +1,123 @@
+
+""" Provides implementation of the class EventSubscriptionServer, a server that streams the rows
+and events of an EventCollectRecorder to local consumers via a unix socket """
+
+import asyncio
+import collections
+import logging
+import os
+
+class _Subscriber():
+    """State of a single connected client: what it subscribed to and a bounded buffer of frames
+    waiting to be sent"""
+
+    def __init__(self, kinds, buffer_size):
+        self.kinds = kinds
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def put(self, frame):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(frame)
+        self.ready.set()
+
+class EventSubscriptionServer():
+    """EventSubscriptionServer publishes the rows and events of an EventCollectRecorder to any
+    number of clients connected to a unix socket. After connecting, a client sends a single line
+    selecting the stream: "rows", "events" or "all". The server answers with a header line and
+    then streams one line per frame:
+        H <column> ...            -- Names of the columns of the rows
+        R <time> <value> ...      -- A row as written to the log file
+        E <time> <source> <event> -- An event as accepted by the recorder
+        D <count>                 -- Number of frames dropped since the last frame
+    Each client has a bounded buffer. When a client does not read fast enough, the oldest frames
+    are dropped and the client is told so by a D frame. Publishing only appends to the buffers,
+    so the recording loop is never blocked by a subscriber.
+    """
+
+    KINDS = {"rows" : ("R",), "events" : ("E",), "all" : ("R", "E")}
+
+    def __init__(self, recorder, path, buffer_size=256):
+        self._recorder = recorder
+        self._path = path
+        self._buffer_size = buffer_size
+        self._subscribers = set()
+        # Writer of each connected client by the task handling it
+        self._clients = {}
+        self._server = None
+
+    async def start(self):
+        """ Start listening on the unix socket and publishing the events of the recorder"""
+        if os.path.exists(self._path):
+            os.remove(self._path)
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self._path)
+        self._recorder.add_row_listener(self._publish_row)
+        self._recorder.add_event_listener(self._publish_event)
+        logging.info("Event subscription server listening on %s", self._path)
+
+    async def close(self):
+        """ Stop publishing, disconnect all clients and remove the socket"""
+        self._recorder.remove_listener(self._publish_row)
+        self._recorder.remove_listener(self._publish_event)
+        if self._server:
+            self._server.close()
+        # Client handlers have to end before wait_closed, it waits for them since Python 3.12
+        subscribers = list(self._subscribers)
+        self._subscribers.clear()
+        for subscriber in subscribers:
+            subscriber.ready.set()
+        clients = dict(self._clients)
+        for writer in clients.values():
+            writer.close()
+        await asyncio.gather(*clients, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+    def _publish_row(self, text):
+        self._publish("R", "R " + text + "\n")
+
+    def _publish_event(self, time, source, event):
+        self._publish("E", "E {} {} {}\n".format(time, source, event))
+
+    def _publish(self, kind, frame):
+        for subscriber in self._subscribers:
+            if kind in subscriber.kinds:
+                subscriber.put(frame)
+
+    async def _handle_client(self, reader, writer):
+        subscriber = None
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            request = (await reader.readline()).decode("utf-8").strip()
+            kinds = self.KINDS.get(request)
+            if kinds is None:
+                logging.warning("Subscription request %r rejected", request)
+                return
+            subscriber = _Subscriber(kinds, self._buffer_size)
+            self._subscribers.add(subscriber)
+            writer.write(("H " + " ".join(self._recorder.column_names()) + "\n").encode("utf-8"))
+            while True:
+                await subscriber.ready.wait()
+                if subscriber not in self._subscribers:
+                    break
+                subscriber.ready.clear()
+                frames = []
+                if subscriber.dropped:
+                    frames.append("D {}\n".format(subscriber.dropped))
+                    subscriber.dropped = 0
+                frames.extend(subscriber.buffer)
+                subscriber.buffer.clear()
+                writer.write("".join(frames).encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._subscribers.discard(subscriber)
+            self._clients.pop(task, None)
+            writer.close()
@@ -3,12 +3,11 @@
 mounted to an oil based rocket burner."""
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.signal import butter, lfilter, lfilter_zi
-from scipy.ndimage.interpolation import shift
 
+# scipy and matplotlib are imported on first use, so tools only reading logs start quickly
 class therm_sens_filter:
     def __init__(self, fcut, fsamp, order, gradient_factor):
+        from scipy.signal import butter
         fnyq = 0.5 * fsamp
         self.b, self.a = butter(order, fcut / fnyq, btype='low')
         self.fcut = fcut
@@ -18,19 +17,27 @@ class therm_sens_filter:
         self.gradient_factor = gradient_factor
         self.init = False
 
-    def filter_data(self, data):
+    def low_pass(self, data):
+        from scipy.signal import lfilter, lfilter_zi
         # Low pass filter as defined in __init__, recognizing initial value
         zi = lfilter_zi(self.b, self.a)
         filtered, zo = lfilter(self.b, self.a, data, zi=zi*data[0])
+        return filtered
+
+    def gradient(self, filtered):
         # Determine gradient for each point
         grad = (filtered[1:] - filtered[:-1]) * self.fsamp
-        grad = np.insert(grad, 0, grad[0])
+        return np.insert(grad, 0, grad[0])
+
+    def filter_data(self, data):
+        filtered = self.low_pass(data)
         # Apply gradient to values to compensate from sensor inertness
-        return filtered + self.gradient_factor * grad
+        return filtered + self.gradient_factor * self.gradient(filtered)
 
     def step(self, x):
         #a[0]*y[n] = b[0]*x[n] + b[1]*x[n-1] + ... + b[nb]*x[n-nb]
         #                      - a[1]*y[n-1] - ... - a[na]*y[n-na]
+        from scipy.ndimage import shift
         if not self.init:
             self.x = np.full(len(self.b), float(x))
             self.y = np.full(len(self.a), float(x))
@@ -49,27 +56,67 @@ class therm_sens_filter:
             out[num] = self.step(val)
         return out
 
-    def plot(self, time, data, state):
+    def plot(self, time, data, state, buckets=None):
+        # Long series are reduced to min/max per pixel column of the figure. On zoom, the
+        # visible range is decimated again from the full data, so details show up. The burner
+        # state is reduced to its transitions, which is exact.
         #time = np.linspace(0, len(data) / self.fsamp, len(data), endpoint=True)
+        import matplotlib.pyplot as plt
+        time = np.asarray(time)
+        data = np.asarray(data)
         filtered = self.filter_data(data)
-        plt.figure(1)
+        fig = plt.figure(1)
         plt.clf()
-        plt.plot(time, data, label='Noisy signal')
-        plt.plot(time, filtered, label='Filtered signal')
-        plt.plot(time, state, label='burner state')
+        if not buckets:
+            buckets = int(fig.get_figwidth() * fig.dpi)
+        data_line, = plt.plot(*decimate_minmax(time, data, time[0], time[-1], buckets),
+                              label='Noisy signal')
+        filtered_line, = plt.plot(*decimate_minmax(time, filtered, time[0], time[-1], buckets),
+                                  label='Filtered signal')
+        plt.plot(*step_transitions(time, np.asarray(state)), drawstyle='steps-post',
+                 label='burner state')
         plt.xlabel('time (seconds)')
         plt.grid(True)
         plt.axis('tight')
         plt.legend(loc='upper left')
+
+        def on_xlim_changed(axes):
+            start, end = axes.get_xlim()
+            data_line.set_data(*decimate_minmax(time, data, start, end, buckets))
+            filtered_line.set_data(*decimate_minmax(time, filtered, start, end, buckets))
+
+        plt.gca().callbacks.connect('xlim_changed', on_xlim_changed)
         plt.show()
 
-if __name__ == "__main__":
-    # Sample rate and desired cutoff frequencies (in Hz).
-    fs = 1.0
-    cut = 0.1
+def decimate_minmax(time, data, start, end, buckets):
+    """Reduce the samples between start and end to the minimum and maximum of each of buckets
+    equally long time intervals. The samples next to the range are included, so lines reach the
+    border. Returns time and data arrays with two points per bucket, ranges with less than two
+    samples per bucket are returned as they are."""
+    first, last = np.searchsorted(time, [start, end])
+    time = time[max(first - 1, 0):last + 1]
+    data = data[max(first - 1, 0):last + 1]
+    if len(time) <= 2 * buckets:
+        return time, data
+    edges = np.unique(np.searchsorted(time, np.linspace(time[0], time[-1], buckets,
+                                                          endpoint=False)))
+    ends = np.append(edges[1:], len(time)) - 1
+    return (np.column_stack((time[edges], time[ends])).ravel(),
+            np.column_stack((np.minimum.reduceat(data, edges),
+                             np.maximum.reduceat(data, edges))).ravel())
 
-    # Filter a temperature signal.
-    in_stream = open("heating.log", "r")
+def step_transitions(time, state):
+    """Reduce a step signal to the first sample, the samples where it changes and the last
+    sample. Plotted with drawstyle 'steps-post' this is identical to the full signal."""
+    index = np.flatnonzero(state[1:] != state[:-1]) + 1
+    index = np.concatenate(([0], index, [len(state) - 1]))
+    return time[index], state[index]
+
+def read_heating_log(path, column=1):
+    """Read a heating.log as written by EventCollectRecorder. Returns the time stamps, the
+    temperature values of the given column and the burner state (True = flame on) as numpy
+    arrays. Lines that cannot be interpreted are reported and skipped."""
+    in_stream = open(path, "r")
     line_list = in_stream.readlines(100000)
     time_list = []
     therm_list = []
@@ -80,15 +127,21 @@ if __name__ == "__main__":
             try:
                 val_list = line.split()
                 time_list.append(float(val_list[0]))
-                therm_list.append(float(val_list[1]))
-                state_list.append(80 if val_list[4] == "on" else 75)
+                therm_list.append(float(val_list[column]))
+                state_list.append(val_list[4] == "on")
                 line_cnt += 1
             except:
                 print("Error interpreting line #{}".format(line_cnt))
         print("Read {} lines".format(line_cnt))
         line_list = in_stream.readlines(100000)
-    t = np.array(time_list) - time_list[0]
-    x = np.array(therm_list)
+    in_stream.close()
+    return np.array(time_list), np.array(therm_list), np.array(state_list)
+
+if __name__ == "__main__":
+    # Filter a temperature signal.
+    time_stamps, x, burner = read_heating_log("heating.log")
+    t = time_stamps - time_stamps[0]
+    state_list = np.where(burner, 80, 75)
 
     fs = (len(t)-1) / (t[-1] - t[0]) # 0.937
     cut = 0.02
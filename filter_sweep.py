@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Parameter sweep for therm_sens_filter. A grid of (fcut, order, gradient_factor) is evaluated
+against a recorded heating.log and the combinations are printed as a ranked table.
+
+Each combination is scored by two figures:
+    lag   -- Mean time (in seconds) from a flame transition until the filtered temperature
+             starts to move in the expected direction (rising on "on", falling on "off")
+    noise -- RMS of the second difference of the filtered temperature, i.e. the amount of
+             high frequency wiggle left in the output
+The ranking uses lag + noise_weight * noise, smaller is better.
+
+For each (fcut, order) pair the low pass filter is run once and all gradient factors are applied
+in a single vectorised step. The pairs are distributed across a process pool.
+"""
+
+import argparse
+import itertools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from filter_design import therm_sens_filter, read_heating_log
+from import_timer import import_report
+
+# Recorded data, set up once per worker process by _init_worker
+_data = None
+
+def _init_worker(data, burner, fsamp):
+    global _data
+    _data = (data, burner, fsamp)
+
+def transitions(burner):
+    """Return the indices where the burner state changes along with the expected direction of
+    the temperature afterwards (+1 for flame on, -1 for flame off)"""
+    index = np.flatnonzero(burner[1:] != burner[:-1]) + 1
+    direction = np.where(burner[index], 1, -1)
+    return index, direction
+
+def score_lag(output, index, direction, fsamp):
+    """Determine the mean lag for each row of output (one row per gradient factor). The lag of a
+    single transition is searched up to the next transition. If the output does not respond
+    until then, the whole interval counts as lag."""
+    slope = np.sign(np.diff(output, axis=1))
+    end = np.append(index[1:], slope.shape[1])
+    lag = np.zeros(output.shape[0])
+    for start, stop, sign in zip(index, end, direction):
+        window = slope[:, start:stop] == sign
+        found = window.any(axis=1)
+        lag += np.where(found, window.argmax(axis=1), stop - start)
+    return lag / max(len(index), 1) / fsamp
+
+def score_noise(output):
+    """Determine the RMS of the second difference for each row of output"""
+    return np.sqrt(np.mean(np.diff(output, n=2, axis=1) ** 2, axis=1))
+
+def evaluate(fcut, order, gradient_factors):
+    """Evaluate all gradient factors for a single (fcut, order) pair against the recorded data
+    of the worker. Returns a list of (fcut, order, gradient_factor, lag, noise) tuples."""
+    data, burner, fsamp = _data
+    filt = therm_sens_filter(fcut, fsamp, order, 0)
+    filtered = filt.low_pass(data)
+    grad = filt.gradient(filtered)
+    factors = np.asarray(gradient_factors, dtype=float)
+    output = filtered[np.newaxis, :] + factors[:, np.newaxis] * grad[np.newaxis, :]
+    index, direction = transitions(burner)
+    lag = score_lag(output, index, direction, fsamp)
+    noise = score_noise(output)
+    return [(fcut, order, factor, l, n) for factor, l, n in zip(factors, lag, noise)]
+
+def sweep(data, burner, fsamp, fcut_list, order_list, gradient_factor_list, workers=None):
+    """Evaluate the grid of filter parameters. Returns an unsorted list of
+    (fcut, order, gradient_factor, lag, noise) tuples."""
+    pairs = list(itertools.product(fcut_list, order_list))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data, burner, fsamp)) as pool:
+        futures = [pool.submit(evaluate, fcut, order, gradient_factor_list)
+                   for fcut, order in pairs]
+        result = []
+        for future in futures:
+            result.extend(future.result())
+    return result
+
+def rank(result, noise_weight):
+    """Sort sweep results by lag + noise_weight * noise, best first"""
+    return sorted(result, key=lambda r: r[3] + noise_weight * r[4])
+
+def print_table(ranked, noise_weight, limit):
+    print("{:>4} {:>8} {:>5} {:>8} {:>9} {:>9} {:>9}"
+          .format("rank", "fcut", "order", "gradient", "lag/s", "noise", "score"))
+    for num, (fcut, order, factor, lag, noise) in enumerate(ranked[:limit]):
+        print("{:4} {:8.4f} {:5} {:8.2f} {:9.2f} {:9.5f} {:9.3f}"
+              .format(num + 1, fcut, order, factor, lag, noise, lag + noise_weight * noise))
+
+def _float_list(text):
+    return [float(val) for val in text.split(",")]
+
+def _int_list(text):
+    return [int(val) for val in text.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", nargs="?", default="heating.log")
+    parser.add_argument("--column", type=int, default=1,
+                        help="Column of the temperature to be filtered (default: 1, Flow)")
+    parser.add_argument("--fcut", type=_float_list,
+                        default=[0.005, 0.01, 0.015, 0.02, 0.03, 0.04, 0.05])
+    parser.add_argument("--order", type=_int_list, default=[1, 2, 3, 4, 5])
+    parser.add_argument("--gradient", type=_float_list,
+                        default=list(np.arange(0., 61., 2.)))
+    parser.add_argument("--noise-weight", type=float, default=100.)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--import-times", action="store_true",
+                        help="Print the time taken by the start of the process to stderr")
+    args = parser.parse_args()
+    if args.import_times:
+        print(import_report(), file=sys.stderr)
+
+    time_stamps, x, burner = read_heating_log(args.log, args.column)
+    fs = (len(time_stamps)-1) / (time_stamps[-1] - time_stamps[0])
+    result = sweep(x, burner, fs, args.fcut, args.order, args.gradient, args.workers)
+    print_table(rank(result, args.noise_weight), args.noise_weight, args.top)
@@ -0,0 +1,44 @@
+
+""" Provides timed_import, importing modules on first use while recording the time the import
+took, and import_report, summarizing the recorded times along with the time since the process
+started. The latter covers the interpreter start and all module level imports, which are not
+recorded by timed_import """
+
+import importlib
+import os
+import sys
+import time
+
+import_times = {}
+_module_import_time = time.perf_counter()
+
+def timed_import(name):
+    """ Import the module name and return it. The time of the first import is recorded"""
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times[name] = time.perf_counter() - start
+    return module
+
+def process_age():
+    """ Return the seconds since the process started. The start time is taken from /proc with a
+    resolution of a clock tick, without /proc the time since import of this module is returned"""
+    try:
+        with open("/proc/self/stat", "r") as stream:
+            # Fields after the command name, starttime is field 22 of the stat line
+            start_ticks = int(stream.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as stream:
+            uptime = float(stream.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.)
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - _module_import_time
+
+def import_report():
+    """ Return the recorded import times as text, slowest import first, followed by their total
+    and the time since the process started"""
+    lines = ["{:8.3f} s {}".format(duration, name) for name, duration
+             in sorted(import_times.items(), key=lambda item: item[1], reverse=True)]
+    lines.append("{:8.3f} s total of imports on use".format(sum(import_times.values())))
+    lines.append("{:8.3f} s since process start".format(process_age()))
+    return "\n".join(lines)
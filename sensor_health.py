@@ -0,0 +1,77 @@
+
+""" Provides implementation of the class SensorHealth, tracking errors of a single sensor and
+deciding when the sensor is to be accessed again after failures """
+
+import logging
+import time
+
+class SensorDisabled(Exception):
+    """Raised or reported instead of a value for a sensor not accessed due to its health"""
+
+class SensorHealth():
+    """SensorHealth implements a circuit breaker for a sensor. As long as the sensor works, the
+    breaker is closed and every access is allowed. After failure_threshold consecutive failures
+    the breaker opens and accesses are refused for a backoff time. When the backoff time elapsed
+    the breaker is half open and a single probe access is allowed. A successful probe closes
+    the breaker, a failed probe opens it again with the backoff time doubled, up to max_backoff.
+    Like this, a dead sensor costs almost no bus time while a recovered sensor is picked up
+    again automatically.
+    """
+
+    CLOSED = "ok"
+    OPEN = "open"
+    HALF_OPEN = "probe"
+
+    def __init__(self, name, failure_threshold=3, backoff=2., max_backoff=300.):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.state = self.CLOSED
+        self.retry_time = 0.
+        self.consecutive_errors = 0
+        self.error_count = 0
+        self.last_error = None
+
+    def allow(self, now=None):
+        """ Return True if the sensor shall be accessed now. While half open, only the probe
+        access is allowed, further accesses are refused until success or failure is reported"""
+        if self.state == self.HALF_OPEN:
+            return False
+        if self.state == self.OPEN:
+            now = time.time() if now is None else now
+            if now < self.retry_time:
+                return False
+            self.state = self.HALF_OPEN
+            logging.info("Sensor %s: Probing after %.0f s", self.name, self.backoff)
+        return True
+
+    def success(self):
+        if self.state != self.CLOSED:
+            logging.info("Sensor %s: Recovered after %d errors", self.name,
+                         self.consecutive_errors)
+        self.state = self.CLOSED
+        self.consecutive_errors = 0
+        self.backoff = self.min_backoff
+
+    def failure(self, error, now=None):
+        now = time.time() if now is None else now
+        self.consecutive_errors += 1
+        self.error_count += 1
+        self.last_error = error
+        if self.state == self.HALF_OPEN:
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            self._open(now)
+        elif self.state == self.CLOSED and self.consecutive_errors >= self.failure_threshold:
+            self._open(now)
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self.retry_time = now + self.backoff
+        logging.warning("Sensor %s: Disabled for %.0f s after %d errors, last error: %r",
+                        self.name, self.backoff, self.consecutive_errors, self.last_error)
+
+    def __str__(self):
+        return "{}(name = {}, state = {}, errors = {})".format(
+            self.__class__.__name__, self.name, self.state, self.error_count)
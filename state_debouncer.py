@@ -0,0 +1,51 @@
+
+""" Provides implementation of the class StateDebouncer, a state machine that suppresses short
+state changes of a sampled signal """
+
+import logging
+
+class StateDebouncer():
+    """StateDebouncer confirms a new state only after it has been sampled continuously for the
+    minimum dwell time of that state. A change back to the confirmed state before the dwell time
+    elapsed is a glitch, it is suppressed and counted. Dwell times are given per state, states
+    not listed use default_dwell. The first sampled state is confirmed immediately.
+    A confirmed transition is reported with the time the new state was sampled first, so the
+    timing of the transition is not delayed by the dwell time.
+    """
+
+    def __init__(self, dwell_times, default_dwell=0.):
+        self.dwell_times = dwell_times
+        self.default_dwell = default_dwell
+        self.state = None
+        self.candidate = None
+        self.candidate_time = None
+        self.suppressed = 0
+
+    def update(self, state, time):
+        """ Feed a sampled state. Returns the tuple (state, time) of a confirmed transition or
+        None if the confirmed state did not change
+
+        Arguments:
+        state -- The sampled state
+        time  -- Time of the sample
+        """
+        if state == self.state:
+            if self.candidate is not None:
+                self._suppress(time)
+            return None
+        if state != self.candidate:
+            if self.candidate is not None:
+                self._suppress(time)
+            self.candidate = state
+            self.candidate_time = time
+        if (self.state is not None and
+                time - self.candidate_time < self.dwell_times.get(state, self.default_dwell)):
+            return None
+        self.state = state
+        self.candidate = None
+        return state, self.candidate_time
+
+    def _suppress(self, time):
+        self.suppressed += 1
+        logging.debug("Suppressed %s of %.2f s", self.candidate, time - self.candidate_time)
+        self.candidate = None
@@ -0,0 +1,168 @@
+
+""" Provides the interface StorageSink for storing the rows of an EventCollectRecorder beyond the
+text log file and SqliteStorageSink, an implementation storing the rows in an SQLite database """
+
+import abc
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+class StorageSink(abc.ABC):
+    """StorageSink is the interface of a storage for the rows finalised by an
+    EventCollectRecorder. A sink is added by EventCollectRecorder.add_storage_sink and is closed
+    by the recorder. All methods are called from the recording loop and therefore shall return
+    quickly. A sink not implementing set_columns and write can not be created.
+    """
+
+    @abc.abstractmethod
+    def set_columns(self, columns):
+        """ Set the names of the columns of the rows, starting with "Time". Called when the sink
+        is added and on each registration of an event source. Columns are only ever added."""
+
+    @abc.abstractmethod
+    def write(self, row):
+        """ Store a row, given as list of values in the order of the columns"""
+
+    def close(self):
+        """ Store all pending rows and release the storage"""
+
+class SqliteStorageSink(StorageSink):
+    """SqliteStorageSink stores rows in a table of an SQLite database. The table has a column per
+    registered event source named like the source. The table is created along with the first
+    rows, with the columns in the order of the registration positions. Sources registered later
+    are appended as columns, as SQLite cannot insert columns. Values are stored with NUMERIC
+    affinity, so temperatures are stored as numbers
+    and states like "on" as text. The Time column is indexed for range queries.
+    Writing happens in a background thread that collects rows into batches and commits each
+    batch as a single transaction. The database uses WAL mode, so it can be queried while rows
+    are written.
+    """
+
+    def __init__(self, path, table="heating", batch_size=100, flush_interval=5.):
+        self._path = path
+        self._table = table
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._columns = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, name="SqliteStorageSink",
+                                        daemon=True)
+        self._thread.start()
+
+    def set_columns(self, columns):
+        new_columns = [column for column in columns if column not in self._columns]
+        if new_columns:
+            self._columns.extend(new_columns)
+            self._queue.put(("columns", list(columns)))
+
+    def write(self, row):
+        self._queue.put(("row", row))
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(("close", None))
+            self._thread.join()
+
+    def query(self, start=None, end=None):
+        """ Return the rows with start <= Time < end as list of tuples in the order of the
+        table columns. Rows still queued for writing are not included. Uses a separate
+        connection, so it may be called from any thread."""
+        condition, parameters = [], []
+        if start is not None:
+            condition.append('"Time" >= ?')
+            parameters.append(start)
+        if end is not None:
+            condition.append('"Time" < ?')
+            parameters.append(end)
+        statement = 'SELECT * FROM "{}"'.format(self._table)
+        if condition:
+            statement += " WHERE " + " AND ".join(condition)
+        statement += ' ORDER BY "Time"'
+        connection = sqlite3.connect(self._path)
+        try:
+            return connection.execute(statement, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def _writer(self):
+        connection = sqlite3.connect(self._path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        columns = []
+        existing = []
+        running = True
+        while running:
+            batch = []
+            command, data = self._queue.get()
+            deadline = time.monotonic() + self._flush_interval
+            # Collect further rows until the batch is full or the flush interval elapsed
+            while True:
+                if command == "close":
+                    running = False
+                    break
+                if command == "columns":
+                    existing = self._store(connection, columns, existing, batch)
+                    batch = []
+                    columns = data
+                else:
+                    batch.append(data)
+                    if len(batch) >= self._batch_size:
+                        break
+                try:
+                    command, data = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            existing = self._store(connection, columns, existing, batch)
+        connection.close()
+
+    def _create_columns(self, connection, columns):
+        """Create the table or add the missing columns. Returns the columns of the table."""
+        try:
+            with connection:
+                definition = ", ".join('"{}" {}'.format(column,
+                                                        "REAL" if column == "Time" else "NUMERIC")
+                                       for column in columns)
+                connection.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'
+                                   .format(self._table, definition))
+                connection.execute('CREATE INDEX IF NOT EXISTS "{0}_time" ON "{0}" ("Time")'
+                                   .format(self._table))
+                existing = self._table_columns(connection)
+                for column in columns:
+                    if column not in existing:
+                        connection.execute('ALTER TABLE "{}" ADD COLUMN "{}" NUMERIC'
+                                           .format(self._table, column))
+        except sqlite3.Error:
+            logging.exception("Creating columns %s in %s failed", columns, self._path)
+        try:
+            return self._table_columns(connection)
+        except sqlite3.Error:
+            logging.exception("Reading columns of %s failed", self._path)
+            return []
+
+    def _table_columns(self, connection):
+        return [info[1] for info in connection.execute(
+            'PRAGMA table_info("{}")'.format(self._table))]
+
+    def _store(self, connection, columns, existing, batch):
+        """Store a batch of rows. Values of columns missing in the table are left out, so a
+        failure to add a column does not lose the rows. Returns the columns of the table."""
+        if not batch:
+            return existing
+        if any(column not in existing for column in columns):
+            existing = self._create_columns(connection, columns)
+        index = [num for num, column in enumerate(columns) if column in existing]
+        if not index:
+            logging.error("Dropping %d rows, table %s in %s has no matching columns",
+                          len(batch), self._table, self._path)
+            return existing
+        statement = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            self._table, ", ".join('"{}"'.format(columns[num]) for num in index),
+            ", ".join("?" * len(index)))
+        try:
+            with connection:
+                connection.executemany(statement, [[row[num] for num in index] for row in batch])
+        except sqlite3.Error:
+            logging.exception("Storing %d rows in %s failed", len(batch), self._path)
+        return existing
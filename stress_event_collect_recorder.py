@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Randomised differential stress test for EventCollectRecorder. Events from many sources are
+created with jittered, out of order and identical time stamps and fed into the recorder. The
+log file written is compared against a simple reference model that sorts all events and fills
+the values forward. Throughput of the recorder is reported, so faster cache or storage
+implementations can be validated and measured in one run.
+"""
+
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from test_exec import *
+from event_collect_recorder import *
+
+def generate_events(count, sources, values, cache_duration, seed):
+    """Return count events as (time, source, value) in order of arrival. Events are spread with
+    jitter, delivered late by up to 90% of cache_duration and quantised to a time grid, so
+    several events share a time stamp."""
+    rng = random.Random(seed)
+    grid = 0.01
+    now = 1.0
+    created = []
+    for num in range(count):
+        now += rng.expovariate(1 / (2 * grid))
+        event_time = round(now / grid) * grid
+        # Groups of events at identical time stamp
+        if rng.random() < 0.1 and created:
+            event_time = created[-1][1]
+        delay = rng.uniform(0, 0.9 * cache_duration) if rng.random() < 0.3 else 0.
+        created.append((event_time + delay, event_time,
+                        "SRC{}".format(rng.randrange(sources)),
+                        "v{}".format(rng.randrange(values))))
+    # Arrival order: by delivery time, creation order for identical delivery time
+    created.sort(key=lambda entry: entry[0])
+    return [(event_time, source, value) for arrival, event_time, source, value in created]
+
+def reference_rows(events, sources, defaults):
+    """Reference model: A row for each distinct time, values filled forward from the last event
+    of each source. Of several events of a source at the same time, the last received wins."""
+    ordered = sorted(enumerate(events), key=lambda entry: (entry[1][0], entry[0]))
+    state = dict(defaults)
+    rows = []
+    for num, (event_time, source, value) in ordered:
+        state[source] = value
+        if rows and rows[-1][0] == event_time:
+            rows[-1] = (event_time, dict(state))
+        else:
+            rows.append((event_time, dict(state)))
+    return [" ".join([str(event_time)] + [values[source] for source in sources])
+            for event_time, values in rows]
+
+def stress(exec, count, sources, values, cache_duration, seed):
+    source_list = ["SRC{}".format(num) for num in range(sources)]
+    defaults = {source: "init{}".format(num) for num, source in enumerate(source_list)}
+    events = generate_events(count, sources, values, cache_duration, seed)
+    print("Generated {} events from {} sources".format(len(events), sources))
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        rec = EventCollectRecorder(path, cache_duration)
+        for num, source in enumerate(source_list):
+            rec.register_event_source(source, num + 1, defaults[source])
+        start = time.perf_counter()
+        for event_time, source, value in events:
+            rec.create_event(source, event_time, value)
+        rec.close()
+        duration = time.perf_counter() - start
+        print("Recorder: {:.2f} s, {:.0f} events/s".format(duration, len(events) / duration))
+
+        start = time.perf_counter()
+        expected = reference_rows(events, source_list, defaults)
+        print("Reference: {:.2f} s".format(time.perf_counter() - start))
+        with open(path, "r", encoding="utf-8") as stream:
+            lines = stream.read().splitlines()
+    finally:
+        os.remove(path)
+
+    exec.report(len(lines) == len(expected),
+                "Rows written ({}) == rows expected ({})".format(len(lines), len(expected)))
+    for num, (line, reference) in enumerate(zip(lines, expected)):
+        if line != reference:
+            exec.report(False, "First difference in row {}:\n  recorder:  {}\n  reference: {}"
+                        .format(num, line, reference))
+            break
+
+if __name__== "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--sources", type=int, default=16)
+    parser.add_argument("--values", type=int, default=4,
+                        help="Number of distinct values per source, small to get repetitions")
+    parser.add_argument("--cache-duration", type=float, default=2.)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    TestExec(stress).execute(args.events, args.sources, args.values, args.cache_duration,
+                             args.seed)
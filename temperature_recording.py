@@ -7,23 +7,26 @@ import traceback
 import signal
 import functools
 import os
+import argparse
 
 import asyncio
 import aiofiles
-import aio_timers
-
-import board
-import busio
-import adafruit_ssd1306
-from PIL import Image, ImageDraw, ImageFont
-import RPi.GPIO as GPIO
 
+from import_timer import timed_import, import_report
 from event_collect_recorder import EventCollectRecorder
+from event_subscription_server import EventSubscriptionServer
+from storage_sink import SqliteStorageSink
+from w1_topology import W1Topology
+from sensor_health import SensorHealth, SensorDisabled
+from state_debouncer import StateDebouncer
 
 class W1_DS18S20:
+    FAMILY = 0x10
+
     def __init__(self, w1_id, name = None):
         self.w1_id = w1_id
-        self.path = '/sys/devices/w1_bus_master1/10-{0:012x}/w1_slave'.format(w1_id)
+        self.slave = '{0:02x}-{1:012x}'.format(self.FAMILY, w1_id)
+        self.path = '/sys/devices/w1_bus_master1/{0}/w1_slave'.format(self.slave)
         self.name = name
         
     async def get_therm(self):
@@ -39,9 +42,12 @@ class W1_DS18S20:
         return "{}(name = {}, path = {})".format(self.__class__.__name__, self.name, self.path)
     
 class W1_DS24S13:
+    FAMILY = 0x3a
+
     def __init__(self, w1_id, name=(None, None)):
         self.w1_id = w1_id
-        self.path = '/sys/devices/w1_bus_master1/3a-{0:012x}/state'.format(w1_id)
+        self.slave = '{0:02x}-{1:012x}'.format(self.FAMILY, w1_id)
+        self.path = '/sys/devices/w1_bus_master1/{0}/state'.format(self.slave)
         self.name = name
         
     async def get_state(self):
@@ -57,6 +63,14 @@ class W1_DS24S13:
     
 class Bonnet_Display:
     def __init__(self, timeout = 10):
+        # Display libraries are loaded on first use, so headless mode does not need them
+        board = timed_import("board")
+        busio = timed_import("busio")
+        adafruit_ssd1306 = timed_import("adafruit_ssd1306")
+        Image = timed_import("PIL.Image")
+        ImageDraw = timed_import("PIL.ImageDraw")
+        ImageFont = timed_import("PIL.ImageFont")
+        self.aio_timers = timed_import("aio_timers")
         self.i2c = busio.I2C(board.SCL, board.SDA)
         self.display = adafruit_ssd1306.SSD1306_I2C(128, 64, self.i2c)
         self.display.contrast(1)
@@ -67,7 +81,7 @@ class Bonnet_Display:
         self.display.show()
         self.timeout = timeout
         self.off_time = time.time() + timeout
-        self.off_timer = aio_timers.Timer(timeout, self._off_timeout)
+        self.off_timer = self.aio_timers.Timer(timeout, self._off_timeout)
         self.display_power = True
         
     def off(self):
@@ -86,7 +100,7 @@ class Bonnet_Display:
         now = time.time()
         remaining_time = self.off_time - now
         if remaining_time > 0:
-            self.off_timer = aio_timers.Timer(remaining_time, self._off_timeout)
+            self.off_timer = self.aio_timers.Timer(remaining_time, self._off_timeout)
         else: 
             self.display.poweroff()
             self.display_power = False
@@ -95,7 +109,7 @@ class Bonnet_Display:
         self.off_time = time.time() + self.timeout
         if not self.display_power:
             self.on()
-            self.off_timer = aio_timers.Timer(self.timeout, self._off_timeout)
+            self.off_timer = self.aio_timers.Timer(self.timeout, self._off_timeout)
         
     def print_line1(self, text, update = True):
         self.draw.rectangle((0, 0, self.display.width, 15), outline=0, fill=0)
@@ -125,6 +139,32 @@ class Bonnet_Display:
         self.draw.line(polygon, width = 1, fill = 1)
         if update: self.display.show()
         
+class Headless_Display:
+    """Replaces Bonnet_Display when running without display, all output is discarded"""
+    def off(self):
+        pass
+        
+    async def async_off(self):
+        pass
+        
+    def on(self):
+        pass
+        
+    def display_on_trigger(self):
+        pass
+        
+    def print_line1(self, text, update = True):
+        pass
+        
+    def print_line2(self, text, update = True):
+        pass
+        
+    def print_line3(self, text, update = True):
+        pass
+        
+    def underline(self, line, start, len, fnum, update = True):
+        pass
+        
 class ButtonEvent:
     _NONE  =  0
     _UP    = -1
@@ -173,6 +213,7 @@ class BonnetButtons:
         self.loop = loop
         self.display=display
         self.event_queue = asyncio.Queue(maxsize=10)
+        GPIO = timed_import("RPi.GPIO")
         pin_list = ButtonEvent.GetPinList()
         GPIO.setup(pin_list, GPIO.IN, pull_up_down=GPIO.PUD_UP)
         for pin in pin_list:
@@ -195,13 +236,21 @@ class BonnetButtons:
 progess='|/-\\'
 
 class ManualThermInput:
+    DEFAULT = 99
+    NAME_TUPLE = ("ManFlow", "ManReturn")
+    
+    @classmethod
+    def register_event_sources(cls, recorder):
+        for num, name in enumerate(cls.NAME_TUPLE):
+            recorder.register_event_source(name, num + 5, str(cls.DEFAULT))
+    
     def __init__(self, display, recorder, loop):
-        self.default = 99
+        self.default = self.DEFAULT
         self.display = display
         self.recorder = recorder
         self.current = 0
         self.active = False
-        self.name_tuple = ("ManFlow", "ManReturn")
+        self.name_tuple = self.NAME_TUPLE
         self.value_list = [self.default] * len(self.name_tuple)
         self.buttons = BonnetButtons(loop, display)
         self.handler = { ButtonEvent.UP    : self.up,
@@ -212,8 +261,7 @@ class ManualThermInput:
                          ButtonEvent.PLUS  : self.plus,
                          ButtonEvent.MINUS : self.minus}
         self.update_display()
-        for num, name in enumerate(self.name_tuple):
-            recorder.register_event_source(name, num + 5, str(self.default))
+        self.register_event_sources(recorder)
         self.value_time = time.time()
         
     async def EventDispatcher(self):
@@ -278,12 +326,28 @@ class ManualThermInput:
                     self.update_value(self.current, self.default)
                     
 class FlameDetector:
-    def __init__(self, display, recorder):
+    """Polls the flame sensor. Short flame activations, e.g. on burner power on, are suppressed
+    by requiring a state to last min_on_time respectively min_off_time before it is recorded"""
+    MIN_ON_TIME = 3.
+    MIN_OFF_TIME = 1.
+    POLL_INTERVAL = 1./4.
+    # A transition is recorded with the time its state was sampled first, so the event lags the
+    # other sources by up to the dwell time plus polling and reading. The cache of the recorder
+    # has to cover this delay, otherwise the transition is a late event.
+    MAX_EVENT_DELAY = max(MIN_ON_TIME, MIN_OFF_TIME) + 2.
+
+    def __init__(self, display, recorder, topology, min_on_time = MIN_ON_TIME,
+                 min_off_time = MIN_OFF_TIME):
         self.display = display
         self.recorder = recorder
+        self.topology = topology
         self.state = "False"
-        self.dio = W1_DS24S13(0x45ee2e, ("Flame", None))
+        # The flame state has a fixed column in the log, see read_heating_log in filter_design
+        (w1_id, name), = topology.slaves(W1_DS24S13.FAMILY, 1)
+        self.dio = W1_DS24S13(w1_id, (name, None))
+        self.health = SensorHealth(name)
         recorder.register_event_source(self.dio.name[0], 4, "init")
+        self.debouncer = StateDebouncer({"on" : min_on_time, "off" : min_off_time})
         self.text = ""
         self.count = 0
         self.value_time = time.time()
@@ -291,7 +355,19 @@ class FlameDetector:
     async def read_output_value(self):
         try:
             self.value_time = time.time()
-            (flame_state, dummy) = await self.dio.get_state()
+            if not self.topology.is_present(self.dio.slave):
+                raise FileNotFoundError(self.dio.path)
+            if not self.health.allow():
+                raise SensorDisabled(self.dio.name[0])
+            try:
+                (flame_state, dummy) = await self.dio.get_state()
+            except Exception as error:
+                self.health.failure(error)
+                if self.health.state == SensorHealth.OPEN:
+                    # Failed probes keep the breaker open, the recorded state is kept as well
+                    raise SensorDisabled(self.dio.name[0]) from error
+                raise
+            self.health.success()
             if flame_state: 
                 text = "aus"
                 self.state = "off"
@@ -299,25 +375,39 @@ class FlameDetector:
                 text =" an"
                 self.state = "on"
         except FileNotFoundError:
+            self.topology.mark_missing(self.dio.slave)
             self.state = "device_error"
             text = "sens"
         except PermissionError:
             self.state = "permission_error"
             text = "perm"
+        except SensorDisabled:
+            self.state = "device_disabled"
+            text = "brk"
+        except Exception:
+            self.state = "read_error"
+            text = "err"
             
-        self.display.print_line2(progess[self.count % 4] + " " + text)
-        if self.text != text:
-            self.recorder.create_event(self.dio.name[0], self.value_time, self.state)
+        transition = self.debouncer.update(self.state, self.value_time)
+        if transition:
+            state, state_time = transition
+            logging.info("Flame %s, %d short activations suppressed so far",
+                         state, self.debouncer.suppressed)
+            try:
+                self.recorder.create_event(self.dio.name[0], state_time, state)
+            except Exception as error:
+                logging.error("Flame %s at %.2f not recorded: %s", state, state_time, error)
             self.text = text
+        self.display.print_line2(progess[self.count % 4] + " " + self.text)
         self.count += 1
         
 class ThermSensors:
-    def __init__(self, display, recorder):
-        sensor_id_name_tuple = ((0x803633136, "Flow"),
-                                (0x803638c68, "Return"),
-                                (0x80373db9b, "Outside"))
+    def __init__(self, display, recorder, topology):
+        # Columns 1 to 3 of the log are given to the sensors, so the number is fixed
+        sensor_id_name_tuple = topology.slaves(W1_DS18S20.FAMILY, 3)
         self.display = display
         self.recorder = recorder
+        self.topology = topology
         self.sampling_time = time.time()
         self.value_time = self.sampling_time
         self.count = 0
@@ -325,28 +415,57 @@ class ThermSensors:
         self.print_task = None
         self.value_list = [None] * len(sensor_id_name_tuple)
         self.sensor_list=[]
+        self.health_list=[]
         for num, id_name in enumerate(sensor_id_name_tuple):
             id, name = id_name
             self.sensor_list.append(W1_DS18S20(id, name))
+            self.health_list.append(SensorHealth(name))
             recorder.register_event_source(name, num + 1, "99.999")
     
+    def _read_tasks(self):
+        return [task for task in self.task_list if isinstance(task, asyncio.Task)]
+
+    def _create_task(self, sens, health):
+        # Sensors not present on the bus or disabled by health are not accessed, the reason is
+        # kept instead of the task
+        if not self.topology.is_present(sens.slave):
+            return FileNotFoundError(sens.path)
+        if not health.allow():
+            return SensorDisabled(sens.name)
+        return asyncio.create_task(sens.get_therm())
+
     async def terminate(self):
         if self.task_list:
-            await asyncio.gather(*self.task_list, return_exceptions=True)
+            await asyncio.gather(*self._read_tasks(), return_exceptions=True)
         if self.print_task: 
             await asyncio.gather(self.print_task, return_exceptions=True)
             
     async def read_output_values(self):
         therm_value_time_new = self.sampling_time
+        therm_value_list_new = []
         if self.task_list:
-            therm_value_list_new = await asyncio.gather(*self.task_list, return_exceptions=True)
-        else:
-            therm_value_list_new = []
+            values = iter(await asyncio.gather(*self._read_tasks(), return_exceptions=True))
+            for task, sens, health in zip(self.task_list, self.sensor_list, self.health_list):
+                if not isinstance(task, asyncio.Task):
+                    therm_value_list_new.append(task)
+                    continue
+                value = next(values)
+                if isinstance(value, float):
+                    health.success()
+                else:
+                    health.failure(value)
+                    if isinstance(value, FileNotFoundError):
+                        self.topology.mark_missing(sens.slave)
+                therm_value_list_new.append(value)
         for value, sens in zip(therm_value_list_new, self.sensor_list):
             value = value if isinstance(value, float) else 99.999
             self.recorder.create_event(sens.name, therm_value_time_new, str(value))
         
-        self.task_list = [asyncio.create_task(sens.get_therm()) for sens in self.sensor_list]
+        self.task_list = [self._create_task(sens, health)
+                          for sens, health in zip(self.sensor_list, self.health_list)]
+        if not self._read_tasks():
+            # Nothing to wait for, keep the loop from spinning
+            await asyncio.sleep(1.)
         self.sampling_time = time.time()
         if self.print_task: 
             await asyncio.gather(self.print_task, return_exceptions=True)
@@ -363,6 +482,8 @@ class ThermSensors:
                 text += "sens "
             elif isinstance(value, PermissionError):
                 text += "perm"
+            elif isinstance(value, SensorDisabled):
+                text += " brk "
             else:
                 text += " err "
         self.display.print_line1(text)
@@ -370,13 +491,13 @@ class ThermSensors:
         
 tasks_to_cancel = []
     
-async def output_detector(display, recorder):
-    flame_detector = FlameDetector(display, recorder)
+async def output_detector(display, recorder, topology):
+    flame_detector = FlameDetector(display, recorder, topology)
     try:
         logging.info("output_detector task loop running")
         while True:
             await flame_detector.read_output_value()
-            await asyncio.sleep(1./4.)
+            await asyncio.sleep(FlameDetector.POLL_INTERVAL)
     except asyncio.CancelledError:
         pass
     logging.info("output_detector task terminated")
@@ -391,8 +512,8 @@ async def input_manual(display, recorder):
         pass
     logging.info("input_manual task terminated")
 
-async def output_therm(display, recorder):
-    therm_sensor_list = ThermSensors(display, recorder)
+async def output_therm(display, recorder, topology):
+    therm_sensor_list = ThermSensors(display, recorder, topology)
     try:
         logging.info("output_therm task loop running")
         while True:
@@ -408,25 +529,50 @@ def exit_handler(signame, loop):
     global tasks_to_cancel
     for task in tasks_to_cancel: task.cancel()
 
-async def main():
+async def main(headless=False):
     loop = asyncio.get_event_loop()
     for signame in {'SIGINT', 'SIGTERM'}:
         loop.add_signal_handler(getattr(signal, signame),
                                 functools.partial(exit_handler, signame, loop))
-    display = Bonnet_Display(300)
-    recorder = EventCollectRecorder("./heating.log")
-    input_task = loop.create_task(input_manual(display, recorder))
-    detector_task = loop.create_task(output_detector(display, recorder))
-    therm_task = loop.create_task(output_therm(display, recorder))
+    topology = W1Topology("./w1_devices.conf")
+    # Check the configuration before anything is recorded, the columns of the log depend on it
+    topology.slaves(W1_DS18S20.FAMILY, 3)
+    topology.slaves(W1_DS24S13.FAMILY, 1)
+    display = Headless_Display() if headless else Bonnet_Display(300)
+    recorder = EventCollectRecorder("./heating.log", FlameDetector.MAX_EVENT_DELAY, journal=True,
+                                    adaptive=True, late_policy="correct")
+    recorder.add_storage_sink(SqliteStorageSink("./heating.sqlite"))
+    subscription_server = EventSubscriptionServer(recorder, "./heating.sock")
+    await subscription_server.start()
+    topology_task = loop.create_task(topology.watch())
+    detector_task = loop.create_task(output_detector(display, recorder, topology))
+    therm_task = loop.create_task(output_therm(display, recorder, topology))
     global tasks_to_cancel
-    tasks_to_cancel = [input_task, detector_task, therm_task]
-    await asyncio.gather(input_task, detector_task, therm_task, return_exceptions=True)
+    tasks_to_cancel = [detector_task, therm_task, topology_task]
+    if headless:
+        # Without buttons there is no manual input, keep the columns of the log nevertheless
+        ManualThermInput.register_event_sources(recorder)
+    else:
+        tasks_to_cancel.append(loop.create_task(input_manual(display, recorder)))
+    # Let the tasks start, so subsystems loaded by them are part of the report
+    await asyncio.sleep(0)
+    logging.info("Import times:\n%s", import_report())
+    for result in await asyncio.gather(*tasks_to_cancel, return_exceptions=True):
+        if isinstance(result, Exception):
+            logging.error("Task failed: %r", result)
+    await subscription_server.close()
+    logging.info("Event lateness: %s", recorder.lateness_statistics())
+    recorder.close()
     await display.async_off()
     logging.info("main done")
 
 if __name__== "__main__":
+    parser = argparse.ArgumentParser(description="Record the state of the heating")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run without display and buttons")
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
+    asyncio.run(main(args.headless))
     logging.info("Gracefully terminated on user request")
     #print("asyncio pending objects")
     #print("-"*60)
@@ -141,6 +141,211 @@ def test_propagate_registation(exec):
                 {'Time':3.0, 'SRC1':'event1_2', 'SRC2':'event2'}]
     exec.report(rec._cache == expected, "Expected progation due to adding event after tail")
 
+def test_update_repeated_value(exec):
+    """An update is not propagated beyond a later event of the same source, even if that event
+    repeated the value before the update"""
+    rec = EventCollectRecorder("./test.txt", 2)
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.create_event("SRC1", 1.0, "A")
+    rec.create_event("SRC1", 3.0, "A")
+    rec.create_event("SRC1", 2.0, "B")
+    expected = [{'Time':1.0, 'SRC1':'A'},
+                {'Time':2.0, 'SRC1':'B'},
+                {'Time':3.0, 'SRC1':'A'}]
+    exec.report(rec._cache == expected, "Later event with repeated value kept")
+    exec.report(rec._head["SRC1"] == "A", "Head keeps later event")
+
+def _remove_journal_files(path):
+    for name in (path, path + ".journal"):
+        if os.path.exists(name):
+            os.remove(name)
+
+def test_journal_restore_after_crash(exec):
+    """Events still in the cache at a power cut are restored from the journal. The values of
+    the last row in the log are used instead of the registration defaults"""
+    _remove_journal_files("./test_journal.txt")
+    rec = EventCollectRecorder("./test_journal.txt", 2, journal=True)
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.register_event_source("SRC2", 2, "init2")
+    rec.create_event("SRC1", 1.0, "event1_1")
+    rec.create_event("SRC2", 4.0, "event2_1")
+    rec.create_event("SRC1", 5.0, "event1_2")
+    # Simulate power cut: Cache is neither dumped nor is the journal compacted
+    rec._journal.close()
+    rec._ostream.close()
+    with open("./test_journal.txt") as stream:
+        lines = stream.readlines()
+    exec.report(lines == ["1.0 event1_1 init2\n"], "Only row before cache window in log")
+    rec = EventCollectRecorder("./test_journal.txt", 2, journal=True)
+    rec.register_event_source("SRC2", 2, "init2")
+    rec.register_event_source("SRC1", 1, "init1")
+    expected = [{'Time':4.0, 'SRC1':'event1_1', 'SRC2':'event2_1'},
+                {'Time':5.0, 'SRC1':'event1_2', 'SRC2':'event2_1'}]
+    exec.report(rec._cache == expected, "Cache restored from journal")
+    rec.close()
+    with open("./test_journal.txt") as stream:
+        lines = stream.readlines()
+    exec.report(lines == ["1.0 event1_1 init2\n",
+                          "4.0 event1_1 event2_1\n",
+                          "5.0 event1_2 event2_1\n"], "No rows lost or duplicated")
+    _remove_journal_files("./test_journal.txt")
+
+def test_journal_restore_adaptive(exec):
+    """The journal is replayed only when all of its sources are registered again. Rows are not
+    written during the replay, even if the journal covers a window wider than the cache
+    duration after restart"""
+    _remove_journal_files("./test_journal.txt")
+    rec = EventCollectRecorder("./test_journal.txt", 2, journal=True, adaptive=True,
+                               late_percentile=100, max_cache_duration=10, late_policy="drop")
+    rec.register_event_source("A", 1, "initA")
+    rec.register_event_source("B", 2, "initB")
+    for num in range(1, 41):
+        rec.create_event("A", float(num), "a{}".format(num))
+        if num > 8:
+            rec.create_event("B", float(num - 8), "b{}".format(num - 8))
+    exec.report(rec.lateness_statistics()["cache_duration"] == 8.0, "Window grew to 8 s")
+    # Simulate power cut
+    rec._journal.close()
+    rec._ostream.close()
+    rec = EventCollectRecorder("./test_journal.txt", 2, journal=True)
+    rec.register_event_source("A", 1, "initA")
+    exec.report(rec._cache == [], "No replay before all sources are registered")
+    rec.register_event_source("B", 2, "initB")
+    exec.report(rec._cache[-1] == {'Time':40.0, 'A':'a40', 'B':'b32'}, "Journal replayed")
+    rec.create_event("A", 41.0, "a41")
+    rec.close()
+    with open("./test_journal.txt") as stream:
+        rows = [line.split() for line in stream]
+    times = [float(row[0]) for row in rows]
+    exec.report(times == [float(num) for num in range(1, 42)],
+                "Rows in order without gaps or duplicates: {}".format(times))
+    exec.report(all(len(row) == 3 for row in rows), "All columns in every row")
+    exec.report(rows[-2:] == [["40.0", "a40", "b32"], ["41.0", "a41", "b32"]], "Last rows")
+    _remove_journal_files("./test_journal.txt")
+
+def test_journal_group_commit(exec):
+    """The journal is synced to disk at most once per JOURNAL_SYNC_INTERVAL, but each event is
+    flushed to the journal file right away"""
+    _remove_journal_files("./test_journal.txt")
+    fsync_calls = []
+    os_fsync = os.fsync
+    os.fsync = lambda fd: fsync_calls.append(fd)
+    try:
+        rec = EventCollectRecorder("./test_journal.txt", 2, journal=True)
+        rec.register_event_source("SRC1", 1, "init1")
+        fsync_calls.clear()
+        for num in range(1, 101):
+            rec.create_event("SRC1", num / 100., "event{}".format(num))
+        exec.report(len(fsync_calls) <= 1, "Syncs ({}) <= 1".format(len(fsync_calls)))
+        with open("./test_journal.txt.journal") as stream:
+            lines = stream.readlines()
+        exec.report(lines[-1] == "E\t1.0\tSRC1\tevent100\n", "Last event flushed")
+        rec.close()
+    finally:
+        os.fsync = os_fsync
+    _remove_journal_files("./test_journal.txt")
+
+def test_journal_restore_last_row(exec):
+    """After a clean shutdown the values of the last row are restored, a partial last line
+    is removed from the log"""
+    _remove_journal_files("./test_journal.txt")
+    rec = EventCollectRecorder("./test_journal.txt", 2, journal=True)
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.register_event_source("SRC3", 3, "init3")
+    rec.create_event("SRC1", 1.0, "event1")
+    rec.create_event("SRC3", 2.0, "event3")
+    rec.close()
+    with open("./test_journal.txt", "a") as stream:
+        stream.write("3.0 even")
+    rec = EventCollectRecorder("./test_journal.txt", 2, journal=True)
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.register_event_source("SRC3", 3, "init3")
+    exec.report(rec._head == {'Time':0, 'SRC1':'event1', 'SRC3':'event3'}, "Last row restored")
+    rec.close()
+    with open("./test_journal.txt") as stream:
+        lines = stream.readlines()
+    exec.report(lines == ["1.0 event1 init3\n", "2.0 event1 event3\n"], "Partial row removed")
+    _remove_journal_files("./test_journal.txt")
+
+def test_late_policy(exec):
+    """Events outside of the cache are handled according to the late policy"""
+    exec.call_except(lambda: EventCollectRecorder("./test.txt", 2, late_policy="ignore"),
+                     Exception)
+    for policy in ("drop", "clamp", "correct"):
+        if os.path.exists("./test.txt.late"):
+            os.remove("./test.txt.late")
+        rec = EventCollectRecorder("./test.txt", 2, late_policy=policy)
+        rec.register_event_source("SRC1", 1, "init1")
+        rec.register_event_source("SRC2", 2, "init2")
+        rec.create_event("SRC1", 1.0, "event1_1")
+        rec.create_event("SRC1", 5.0, "event1_2")
+        exec.call_except(lambda: rec.create_event("SRC2", 2.0, "late2"), None)
+        stats = rec.lateness_statistics()
+        exec.report(stats["SRC2"]["late"] == 1, "Late event counted for {}".format(policy))
+        if policy == "clamp":
+            expected = [{'Time':5.0, 'SRC1':'event1_2', 'SRC2':'late2'}]
+        else:
+            expected = [{'Time':5.0, 'SRC1':'event1_2', 'SRC2':'init2'}]
+        exec.report(rec._cache == expected, "Cache after late event for {}".format(policy))
+        rec.close()
+        if policy == "correct":
+            with open("./test.txt.late") as stream:
+                exec.report(stream.readlines() == ["2.0 SRC2 late2\n"], "Correction record")
+            os.remove("./test.txt.late")
+    # A late event is not clamped onto a more recent event of the same source
+    rec = EventCollectRecorder("./test.txt", 2, late_policy="clamp")
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.register_event_source("SRC2", 2, "init2")
+    rec.create_event("SRC1", 1.0, "event1_1")
+    rec.create_event("SRC2", 4.0, "new2")
+    rec.create_event("SRC1", 5.0, "event1_2")
+    rec.create_event("SRC2", 1.5, "old2")
+    expected = [{'Time':4.0, 'SRC1':'event1_1', 'SRC2':'new2'},
+                {'Time':5.0, 'SRC1':'event1_2', 'SRC2':'new2'}]
+    exec.report(rec._cache == expected, "Recent event kept on clamp")
+    exec.report(rec.lateness_statistics()["SRC2"]["late"] == 1, "Late event counted on clamp")
+    rec.close()
+
+def test_adaptive_window(exec):
+    """In adaptive mode the cache duration follows the observed lateness"""
+    rec = EventCollectRecorder("./test.txt", 1, adaptive=True, late_percentile=50,
+                               max_cache_duration=10, late_policy="drop")
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.register_event_source("SRC2", 2, "init2")
+    for num in range(10):
+        rec.create_event("SRC1", 10.0 + num, "event1")
+        rec.create_event("SRC2", 10.0 + num - 3.0, "event2")
+    stats = rec.lateness_statistics()
+    exec.report(stats["SRC2"]["percentile"] == 3.0, "Lateness percentile of SRC2")
+    exec.report(stats["SRC1"]["max"] == 0.0, "No lateness of SRC1")
+    exec.report(stats["cache_duration"] == 3.0, "Cache duration adapted to lateness")
+    exec.report(stats["SRC2"]["late"] == 1, "Only the event before adaption is late")
+
+def test_adaptive_window_written_rows(exec):
+    """A late event does not widen the window for itself. Events at or before rows written
+    already are late, even after the window grew past them"""
+    for policy in ("drop", "clamp"):
+        rec = EventCollectRecorder("./test_late.txt", 2, adaptive=True, late_percentile=100,
+                                   max_cache_duration=10, late_policy=policy)
+        rec.register_event_source("T", 1, "init")
+        rec.register_event_source("F", 2, "init")
+        for num in range(1, 11):
+            rec.create_event("T", float(num), "t{}".format(num))
+        rec.create_event("F", 7.0, "on")
+        exec.report(rec.lateness_statistics()["F"]["late"] == 1,
+                    "Event behind cache is late for {}".format(policy))
+        exec.report(rec.lateness_statistics()["cache_duration"] == 3.0, "Window grew afterwards")
+        # Window reaches back to 7.0 now, but the row at 7.0 is written already
+        rec.create_event("F", 7.0, "on")
+        exec.report(rec.lateness_statistics()["F"]["late"] == 2,
+                    "Event before tail is late for {}".format(policy))
+        rec.close()
+        with open("./test_late.txt") as stream:
+            times = [line.split()[0] for line in stream]
+        os.remove("./test_late.txt")
+        exec.report(len(times) == len(set(times)) == 10,
+                    "No duplicate rows for {}: {}".format(policy, times))
+
 if __name__== "__main__":
     #logging.basicConfig(level=logging.DEBUG)
     TestExec(test_registration_pos_0).execute()
@@ -152,4 +357,12 @@ if __name__== "__main__":
     TestExec(test_dump_on_time_exceed).execute()
     TestExec(test_update_event).execute()
     TestExec(test_propagate_registation).execute()
+    TestExec(test_update_repeated_value).execute()
+    TestExec(test_journal_restore_after_crash).execute()
+    TestExec(test_journal_restore_adaptive).execute()
+    TestExec(test_journal_group_commit).execute()
+    TestExec(test_journal_restore_last_row).execute()
+    TestExec(test_late_policy).execute()
+    TestExec(test_adaptive_window).execute()
+    TestExec(test_adaptive_window_written_rows).execute()
     
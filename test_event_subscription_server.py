@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import os
+import asyncio
+import logging
+from test_exec import *
+from event_collect_recorder import *
+from event_subscription_server import *
+
+SOCKET_PATH = "./test.sock"
+
+def _create_recorder():
+    rec = EventCollectRecorder("./test.txt", 2)
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.register_event_source("SRC2", 2, "init2")
+    return rec
+
+async def _subscribe(kind):
+    reader, writer = await asyncio.open_unix_connection(SOCKET_PATH)
+    writer.write((kind + "\n").encode("utf-8"))
+    header = await reader.readline()
+    return reader, writer, header.decode("utf-8")
+
+async def _read_lines(reader, num):
+    return [(await reader.readline()).decode("utf-8") for _ in range(num)]
+
+def test_stream_rows_and_events(exec):
+    """Rows written to the log are streamed to row subscribers, accepted events to event
+    subscribers"""
+    async def run():
+        rec = _create_recorder()
+        server = EventSubscriptionServer(rec, SOCKET_PATH)
+        await server.start()
+        row_reader, row_writer, header = await _subscribe("rows")
+        exec.report(header == "H Time SRC1 SRC2\n", "Header with column names")
+        event_reader, event_writer, header = await _subscribe("events")
+        await asyncio.sleep(0.05)
+        rec.create_event("SRC1", 1.0, "event1")
+        rec.create_event("SRC2", 4.0, "event2")
+        lines = await asyncio.wait_for(_read_lines(row_reader, 1), 1)
+        exec.report(lines == ["R 1.0 event1 init2\n"], "Row streamed")
+        lines = await asyncio.wait_for(_read_lines(event_reader, 2), 1)
+        exec.report(lines == ["E 1.0 SRC1 event1\n", "E 4.0 SRC2 event2\n"], "Events streamed")
+        row_writer.close()
+        event_writer.close()
+        await server.close()
+        exec.report(not os.path.exists(SOCKET_PATH), "Socket removed")
+    asyncio.run(run())
+
+def test_slow_consumer(exec):
+    """A client not reading its stream does not block the recorder, frames beyond the buffer
+    are dropped and reported"""
+    async def run():
+        rec = _create_recorder()
+        server = EventSubscriptionServer(rec, SOCKET_PATH, buffer_size=4)
+        await server.start()
+        reader, writer, header = await _subscribe("events")
+        await asyncio.sleep(0.05)
+        # No await in between, so the server has no chance to send anything
+        for num in range(1, 11):
+            rec.create_event("SRC1", float(num), "event{}".format(num))
+        lines = await asyncio.wait_for(_read_lines(reader, 5), 1)
+        exec.report(lines == ["D 6\n"] + ["E {}.0 SRC1 event{}\n".format(num, num)
+                                          for num in range(7, 11)],
+                    "Oldest frames dropped and reported")
+        writer.close()
+        await server.close()
+    asyncio.run(run())
+
+def test_close_with_connected_clients(exec):
+    """Closing the server does not wait for clients to disconnect, neither for subscribed
+    clients nor for clients that did not send a request yet"""
+    async def run():
+        rec = _create_recorder()
+        server = EventSubscriptionServer(rec, SOCKET_PATH)
+        await server.start()
+        reader, writer, header = await _subscribe("rows")
+        idle_reader, idle_writer = await asyncio.open_unix_connection(SOCKET_PATH)
+        await asyncio.sleep(0.05)
+        try:
+            await asyncio.wait_for(server.close(), 2)
+        except asyncio.TimeoutError:
+            exec.report(False, "Server close timed out")
+        line = await asyncio.wait_for(reader.readline(), 1)
+        exec.report(line == b"", "Subscribed client disconnected")
+        writer.close()
+        idle_writer.close()
+    asyncio.run(run())
+
+def test_invalid_request(exec):
+    """A client with an unknown subscription request is disconnected"""
+    async def run():
+        rec = _create_recorder()
+        server = EventSubscriptionServer(rec, SOCKET_PATH)
+        await server.start()
+        reader, writer, header = await _subscribe("everything")
+        exec.report(header == "", "Connection closed without header")
+        writer.close()
+        await server.close()
+    asyncio.run(run())
+
+if __name__== "__main__":
+    #logging.basicConfig(level=logging.DEBUG)
+    TestExec(test_stream_rows_and_events).execute()
+    TestExec(test_slow_consumer).execute()
+    TestExec(test_close_with_connected_clients).execute()
+    TestExec(test_invalid_request).execute()
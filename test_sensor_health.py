@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import logging
+from test_exec import *
+from sensor_health import *
+
+def test_open_after_threshold(exec):
+    """Accesses are refused after failure_threshold consecutive failures until backoff elapsed"""
+    health = SensorHealth("SENS", failure_threshold=3, backoff=2.)
+    for num in range(2):
+        health.failure(FileNotFoundError(), now=10.)
+        exec.report(health.allow(now=10.), "Access allowed below threshold")
+    health.failure(FileNotFoundError(), now=10.)
+    exec.report(health.state == SensorHealth.OPEN, "Breaker open at threshold")
+    exec.report(not health.allow(now=11.), "Access refused during backoff")
+    exec.report(health.allow(now=12.), "Probe allowed after backoff")
+    exec.report(health.state == SensorHealth.HALF_OPEN, "Breaker half open while probing")
+
+def test_single_probe(exec):
+    """While half open only a single probe is allowed until its result is reported"""
+    for report in ("success", "failure"):
+        health = SensorHealth("SENS", failure_threshold=1, backoff=2.)
+        health.failure(FileNotFoundError(), now=0.)
+        exec.report(health.allow(now=2.), "Probe allowed after backoff")
+        exec.report(not health.allow(now=2.), "Second access refused while probing")
+        exec.report(not health.allow(now=3.), "Access refused until probe reported")
+        if report == "success":
+            health.success()
+            exec.report(health.allow(now=3.), "Access allowed after successful probe")
+        else:
+            health.failure(FileNotFoundError(), now=3.)
+            exec.report(not health.allow(now=3.), "Access refused after failed probe")
+            exec.report(health.allow(now=7.), "Next probe allowed after doubled backoff")
+            exec.report(not health.allow(now=7.), "Single probe again")
+
+def test_backoff_doubles(exec):
+    """A failed probe opens the breaker again with doubled backoff, limited to max_backoff"""
+    health = SensorHealth("SENS", failure_threshold=1, backoff=2., max_backoff=5.)
+    health.failure(ValueError(), now=0.)
+    now = 0.
+    for expected in (4., 5., 5.):
+        now = health.retry_time
+        exec.report(health.allow(now=now), "Probe allowed")
+        health.failure(ValueError(), now=now)
+        exec.report(health.retry_time - now == expected,
+                    "Backoff {} == {}".format(health.retry_time - now, expected))
+
+def test_recover(exec):
+    """A successful probe closes the breaker and resets the backoff"""
+    health = SensorHealth("SENS", failure_threshold=1, backoff=2.)
+    health.failure(ValueError(), now=0.)
+    health.allow(now=2.)
+    health.failure(ValueError(), now=2.)
+    health.allow(now=6.)
+    health.success()
+    exec.report(health.state == SensorHealth.CLOSED, "Breaker closed after successful probe")
+    exec.report(health.backoff == 2., "Backoff reset")
+    exec.report(health.consecutive_errors == 0 and health.error_count == 2, "Error counters")
+
+if __name__== "__main__":
+    #logging.basicConfig(level=logging.DEBUG)
+    TestExec(test_open_after_threshold).execute()
+    TestExec(test_single_probe).execute()
+    TestExec(test_backoff_doubles).execute()
+    TestExec(test_recover).execute()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import logging
+from test_exec import *
+from state_debouncer import *
+
+def _feed(debouncer, samples):
+    return [debouncer.update(state, time) for time, state in samples]
+
+def test_first_state(exec):
+    """The first sampled state is confirmed immediately"""
+    debouncer = StateDebouncer({"on" : 3.})
+    exec.report(debouncer.update("on", 1.0) == ("on", 1.0), "First state confirmed")
+
+def test_suppress_glitch(exec):
+    """A state shorter than its dwell time is suppressed and counted"""
+    debouncer = StateDebouncer({"on" : 3., "off" : 1.})
+    result = _feed(debouncer, [(0.0, "off"), (1.0, "on"), (2.0, "on"), (3.0, "off"),
+                               (4.0, "on"), (5.0, "off")])
+    exec.report(result == [("off", 0.0), None, None, None, None, None], "No transition")
+    exec.report(debouncer.suppressed == 2, "Glitches counted")
+    exec.report(debouncer.state == "off", "State unchanged")
+
+def test_confirm_transition(exec):
+    """A state lasting its dwell time is confirmed with the time it was sampled first"""
+    debouncer = StateDebouncer({"on" : 3., "off" : 1.})
+    result = _feed(debouncer, [(0.0, "off"), (1.0, "on"), (2.5, "on"), (4.0, "on"),
+                               (5.0, "on"), (6.0, "off"), (7.0, "off")])
+    exec.report(result == [("off", 0.0), None, None, ("on", 1.0), None, None, ("off", 6.0)],
+                "Transitions confirmed")
+    exec.report(debouncer.suppressed == 0, "Nothing suppressed")
+
+def test_default_dwell(exec):
+    """States without dwell time are confirmed immediately, replacing a pending state"""
+    debouncer = StateDebouncer({"on" : 3.})
+    result = _feed(debouncer, [(0.0, "off"), (1.0, "on"), (2.0, "device_error")])
+    exec.report(result == [("off", 0.0), None, ("device_error", 2.0)], "Error passed through")
+    exec.report(debouncer.suppressed == 1, "Pending state counted as suppressed")
+
+if __name__== "__main__":
+    #logging.basicConfig(level=logging.DEBUG)
+    TestExec(test_first_state).execute()
+    TestExec(test_suppress_glitch).execute()
+    TestExec(test_confirm_transition).execute()
+    TestExec(test_default_dwell).execute()
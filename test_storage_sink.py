@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+import os
+import logging
+from test_exec import *
+from event_collect_recorder import *
+from storage_sink import *
+
+DB_PATH = "./test.sqlite"
+
+def _remove_database():
+    for name in (DB_PATH, DB_PATH + "-wal", DB_PATH + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+def test_sqlite_rows(exec):
+    """Rows written to the log are stored in the database, the schema follows the registration
+    positions and numbers are stored as numbers"""
+    _remove_database()
+    rec = EventCollectRecorder("./test.txt", 2)
+    sink = SqliteStorageSink(DB_PATH, batch_size=2, flush_interval=0.1)
+    rec.add_storage_sink(sink)
+    rec.register_event_source("Flame", 2, "init")
+    rec.register_event_source("Flow", 1, "99.999")
+    rec.create_event("Flow", 1.0, "45.5")
+    rec.create_event("Flame", 2.0, "on")
+    rec.create_event("Flow", 3.0, "46.0")
+    rec.close()
+    rows = sink.query()
+    exec.report(rows == [(1.0, 45.5, "init"), (2.0, 45.5, "on"), (3.0, 46.0, "on")],
+                "All rows stored with numeric values, columns in position order")
+    exec.report(sink.query(1.5, 3.0) == [(2.0, 45.5, "on")], "Range query")
+    _remove_database()
+
+def test_sqlite_add_column(exec):
+    """Sources registered after rows have been stored get a new column"""
+    _remove_database()
+    rec = EventCollectRecorder("./test.txt", 2)
+    sink = SqliteStorageSink(DB_PATH)
+    rec.add_storage_sink(sink)
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.create_event("SRC1", 1.0, "event1_1")
+    rec.create_event("SRC1", 4.0, "event1_2")
+    rec.register_event_source("SRC2", 2, "init2")
+    rec.close()
+    rows = sink.query()
+    exec.report(rows == [(1.0, "event1_1", None), (4.0, "event1_2", "init2")],
+                "Column added for late registration")
+    _remove_database()
+
+def test_sqlite_column_failure(exec):
+    """Rows are stored even if a column cannot be added, leaving out the missing column"""
+    _remove_database()
+    rec = EventCollectRecorder("./test.txt", 2)
+    sink = SqliteStorageSink(DB_PATH)
+    rec.add_storage_sink(sink)
+    rec.register_event_source("SRC1", 1, "init1")
+    rec.create_event("SRC1", 1.0, "event1_1")
+    rec.create_event("SRC1", 4.0, "event1_2")
+    # SQLite column names are case insensitive, so the column can not be added
+    rec.register_event_source("src1", 2, "init2")
+    rec.close()
+    exec.report(sink.query() == [(1.0, "event1_1"), (4.0, "event1_2")],
+                "Row stored without failed column")
+    _remove_database()
+
+def test_incomplete_sink(exec):
+    """A sink not implementing the interface fails on creation"""
+    class IncompleteSink(StorageSink):
+        def set_columns(self, columns):
+            pass
+    exec.call_except(IncompleteSink, TypeError)
+
+if __name__== "__main__":
+    #logging.basicConfig(level=logging.DEBUG)
+    TestExec(test_sqlite_rows).execute()
+    TestExec(test_sqlite_add_column).execute()
+    TestExec(test_sqlite_column_failure).execute()
+    TestExec(test_incomplete_sink).execute()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os
+import types
+import shutil
+import asyncio
+import tempfile
+import logging
+from test_exec import *
+from event_collect_recorder import *
+from w1_topology import *
+import temperature_recording
+import sensor_health
+from temperature_recording import FlameDetector, Headless_Display
+
+def _flame(flame_on):
+    """ Return a get_state function for _run_flame_detector, the flame being on in the interval
+    flame_on """
+    def get_state(now):
+        # PIOA is low while the flame is on
+        return not flame_on[0] <= now < flame_on[1], False
+    return get_state
+
+def _run_flame_detector(recorder, get_state, end_time):
+    """ Poll a FlameDetector with simulated time, get_state(time) giving the state of the flame
+    sensor. A temperature source creates an event at every poll like ThermSensors does. Returns
+    the rows written by the recorder as (time, flame) tuples."""
+    master_path = tempfile.mkdtemp()
+    with open(os.path.join(master_path, "w1_master_slaves"), "w") as stream:
+        stream.write("3a-00000045ee2e\n")
+    config_path = os.path.join(master_path, "w1_devices.conf")
+    with open(config_path, "w") as stream:
+        stream.write("3a-00000045ee2e Flame\n")
+    clock = types.SimpleNamespace(now=1.)
+    rows = []
+    recorder.add_row_listener(lambda text: rows.append((float(text.split()[0]),
+                                                        text.split()[-1])))
+    recorder.register_event_source("Flow", 1, "init")
+    detector = FlameDetector(Headless_Display(), recorder, W1Topology(config_path, master_path))
+
+    async def get_state_now():
+        return get_state(clock.now)
+    detector.dio.get_state = get_state_now
+
+    async def poll():
+        while clock.now < end_time:
+            recorder.create_event("Flow", clock.now, "45.0")
+            await detector.read_output_value()
+            clock.now += FlameDetector.POLL_INTERVAL
+    time_module = temperature_recording.time
+    temperature_recording.time = types.SimpleNamespace(time=lambda: clock.now)
+    sensor_health.time = temperature_recording.time
+    try:
+        asyncio.run(poll())
+    finally:
+        temperature_recording.time = time_module
+        sensor_health.time = time_module
+        recorder.close()
+        shutil.rmtree(master_path)
+    return rows
+
+def test_flame_transitions_recorded(exec):
+    """Transitions confirmed after the dwell time are stamped with the time the flame changed
+    and are accepted by a recorder using the cache duration of main"""
+    rec = EventCollectRecorder("./test.txt", FlameDetector.MAX_EVENT_DELAY)
+    rows = _run_flame_detector(rec, _flame((10., 30.)), 40.)
+    changes = [row for num, row in enumerate(rows) if num == 0 or row[1] != rows[num - 1][1]]
+    exec.report(changes == [(1.0, "off"), (10.0, "on"), (30.0, "off")],
+                "Flame transitions {}".format(changes))
+    exec.report(len(rows) == len(set(row[0] for row in rows)), "Rows unique in time")
+    exec.report(rows[-1][0] == 39.75, "All rows written")
+
+def test_flame_transition_late(exec):
+    """A transition not accepted by the recorder is logged, the detector keeps polling"""
+    rec = EventCollectRecorder("./test.txt", 1)
+    rows = _run_flame_detector(rec, _flame((10., 30.)), 40.)
+    exec.report(rows[-1] == (39.75, "off"), "Detector still running")
+    exec.report(all(flame != "on" for time, flame in rows), "Late transition not recorded")
+
+def test_flame_sensor_failing(exec):
+    """While the breaker of the flame sensor is open, failed probes do not change the recorded
+    state"""
+    def get_state(now):
+        if now >= 10.:
+            raise OSError("No response")
+        return True, False
+    rec = EventCollectRecorder("./test.txt", FlameDetector.MAX_EVENT_DELAY)
+    rows = _run_flame_detector(rec, get_state, 60.)
+    changes = [row for num, row in enumerate(rows) if num == 0 or row[1] != rows[num - 1][1]]
+    exec.report(changes == [(1.0, "off"), (10.0, "read_error"), (10.5, "device_disabled")],
+                "Flame states {}".format(changes))
+
+if __name__== "__main__":
+    #logging.basicConfig(level=logging.DEBUG)
+    TestExec(test_flame_transitions_recorded).execute()
+    TestExec(test_flame_transition_late).execute()
+    TestExec(test_flame_sensor_failing).execute()
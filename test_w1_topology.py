@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import logging
+from test_exec import *
+from w1_topology import *
+
+CONFIG = """# Sensors in the order of the columns of the log
+10-000803633136 Flow
+10-000803638c68 Return   # comment after the name
+malformed line here
+
+10-00080373db9b Outside
+3a-00000045ee2e Flame
+"""
+
+def _master(slaves):
+    """ Create a directory looking like the sysfs directory of a bus master """
+    path = tempfile.mkdtemp()
+    _write_slaves(path, slaves)
+    return path
+
+def _write_slaves(path, slaves):
+    with open(os.path.join(path, "w1_master_slaves"), "w") as stream:
+        stream.write("".join(slave + "\n" for slave in slaves))
+
+def _topology(master_path):
+    config_path = os.path.join(master_path, "w1_devices.conf")
+    with open(config_path, "w") as stream:
+        stream.write(CONFIG)
+    return W1Topology(config_path, master_path)
+
+def test_read_config(exec):
+    """Comments, empty and malformed lines are skipped, the order of the lines is kept"""
+    path = _master([])
+    topology = _topology(path)
+    exec.report(topology.name_list == [("10-000803633136", "Flow"),
+                                       ("10-000803638c68", "Return"),
+                                       ("10-00080373db9b", "Outside"),
+                                       ("3a-00000045ee2e", "Flame")],
+                "Config read {}".format(topology.name_list))
+    shutil.rmtree(path)
+
+def test_read_config_invalid_slave(exec):
+    """A slave not given as <family>-<serial>, e.g. with name and slave swapped, is reported"""
+    path = _master([])
+    config_path = os.path.join(path, "w1_devices.conf")
+    with open(config_path, "w") as stream:
+        stream.write("10-000803633136 Flow\nReturn 10-000803638c68\n")
+    try:
+        W1Topology(config_path, path)
+        exec.report(False, "No error for swapped slave and name")
+    except W1ConfigError as error:
+        exec.report("w1_devices.conf:2" in str(error), "Error reports line: {}".format(error))
+    shutil.rmtree(path)
+
+def test_slaves(exec):
+    """Slaves of a family are returned with their serial number as int, a count is checked"""
+    path = _master([])
+    topology = _topology(path)
+    exec.report(topology.slaves(0x10, 3) == [(0x000803633136, "Flow"),
+                                             (0x000803638c68, "Return"),
+                                             (0x00080373db9b, "Outside")],
+                "Temperature sensors in config order")
+    exec.report(topology.slaves(0x3a) == [(0x00000045ee2e, "Flame")], "Flame detector")
+    for family, count in ((0x10, 4), (0x10, 2), (0x3a, 2)):
+        try:
+            topology.slaves(family, count)
+            exec.report(False, "No error for {} slaves of family {:02x}".format(count, family))
+        except W1ConfigError:
+            exec.report(True, "Error for {} slaves of family {:02x}".format(count, family))
+    topology.name_list = [slave for slave in topology.name_list if slave[1] != "Flame"]
+    exec.report(topology.slaves(0x3a) == [], "No flame detector configured")
+    try:
+        topology.slaves(0x3a, 1)
+        exec.report(False, "No error for missing flame detector")
+    except W1ConfigError:
+        exec.report(True, "Error for missing flame detector")
+    shutil.rmtree(path)
+
+def test_scan(exec):
+    """Slaves added and removed on the bus are detected by rescans"""
+    path = _master(["10-000803633136", "3a-00000045ee2e"])
+    topology = _topology(path)
+    exec.report(topology.present == {"10-000803633136", "3a-00000045ee2e"}, "Initial scan")
+    _write_slaves(path, ["10-000803633136", "10-000803638c68"])
+    topology.scan()
+    exec.report(topology.is_present("10-000803638c68"), "Slave added")
+    exec.report(not topology.is_present("3a-00000045ee2e"), "Slave removed")
+    _write_slaves(path, ["not found."])
+    topology.scan()
+    exec.report(topology.present == set(), "No slave on the bus")
+    os.remove(os.path.join(path, "w1_master_slaves"))
+    topology.scan()
+    exec.report(topology.present == set(), "Bus master missing")
+    shutil.rmtree(path)
+
+def test_mark_missing(exec):
+    """A slave marked missing is not present until the next scan finds it again"""
+    path = _master(["10-000803633136"])
+    topology = _topology(path)
+    topology.mark_missing("10-000803633136")
+    exec.report(not topology.is_present("10-000803633136"), "Slave marked missing")
+    topology.mark_missing("10-000803638c68")
+    exec.report(topology.present == set(), "Marking an absent slave has no effect")
+    topology.scan()
+    exec.report(topology.is_present("10-000803633136"), "Slave present again after scan")
+    shutil.rmtree(path)
+
+if __name__== "__main__":
+    #logging.basicConfig(level=logging.DEBUG)
+    TestExec(test_read_config).execute()
+    TestExec(test_read_config_invalid_slave).execute()
+    TestExec(test_slaves).execute()
+    TestExec(test_scan).execute()
+    TestExec(test_mark_missing).execute()
@@ -0,0 +1,92 @@
+
+""" Provides implementation of the class W1Topology, a cache of the slaves present on the 1-wire
+bus along with the names they are known by """
+
+import asyncio
+import logging
+import re
+
+class W1ConfigError(Exception):
+    """Raised when the configured slaves do not match what is expected"""
+
+class W1Topology():
+    """W1Topology enumerates the slaves of the 1-wire bus master once and caches the result, so
+    sensors only access devices that are present. Slaves are identified by their sysfs name, e.g.
+    "10-000803633136" (family code and serial number). Names are assigned to slaves by a config
+    file with one "<slave> <name>" pair per line, '#' starts a comment. The order of the lines
+    is kept, as it gives the order of the sensors.
+    The kernel does not emit inotify events for sysfs, so add and remove of slaves are detected
+    by re-reading the slave list of the bus master periodically (see watch). A slave that fails
+    to be read can be marked missing right away to stop further accesses until it shows up
+    again on the bus.
+    """
+
+    SLAVE_PATTERN = re.compile("^[0-9a-f]{2}-[0-9a-f]{12}$")
+
+    def __init__(self, config_path, master_path="/sys/devices/w1_bus_master1"):
+        self.master_path = master_path
+        self.name_list = self.read_config(config_path)
+        self.present = set()
+        self.scan()
+
+    @classmethod
+    def read_config(cls, path):
+        """ Return the (slave, name) tuples of the config file. W1ConfigError is raised for a
+        slave not given as <family>-<serial> in hex digits"""
+        name_list = []
+        with open(path, "r", encoding="utf-8") as stream:
+            for num, line in enumerate(stream, 1):
+                fields = line.split("#")[0].split()
+                if len(fields) == 2:
+                    if not cls.SLAVE_PATTERN.match(fields[0]):
+                        raise W1ConfigError("{}:{}: Invalid 1-wire slave {!r}, expected "
+                                            "<family>-<serial>".format(path, num, fields[0]))
+                    name_list.append((fields[0], fields[1]))
+                elif fields:
+                    logging.warning("Ignoring line in %s: %s", path, line.strip())
+        return name_list
+
+    def slaves(self, family, count=None):
+        """ Return (w1_id, name) tuples of the configured slaves of the given family code, w1_id
+        being the serial number as int. If count is given, exactly count slaves of the family
+        have to be configured, W1ConfigError is raised otherwise."""
+        slave_list = [(int(slave[3:], 16), name) for slave, name in self.name_list
+                      if int(slave[:2], 16) == family]
+        if count is not None and len(slave_list) != count:
+            raise W1ConfigError("Expected {} 1-wire slaves of family {:02x} in configuration, "
+                                "found {}: {}".format(count, family, len(slave_list),
+                                                      [name for w1_id, name in slave_list]))
+        return slave_list
+
+    def is_present(self, slave):
+        return slave in self.present
+
+    def mark_missing(self, slave):
+        if slave in self.present:
+            logging.warning("1-wire slave %s failed, marked missing until next scan", slave)
+            self.present.discard(slave)
+
+    def scan(self):
+        """ Read the slave list of the bus master and log slaves added or removed """
+        try:
+            with open(self.master_path + "/w1_master_slaves", "r") as stream:
+                present = set(line.strip() for line in stream if line.strip())
+        except OSError as error:
+            logging.warning("Scanning 1-wire bus master failed: %s", error)
+            present = set()
+        # Kernel reports "not found." in case there is no slave on the bus
+        present.discard("not found.")
+        for slave in sorted(present - self.present):
+            logging.info("1-wire slave %s added", slave)
+        for slave in sorted(self.present - present):
+            logging.info("1-wire slave %s removed", slave)
+        self.present = present
+
+    async def watch(self, interval=10.):
+        """ Rescan the bus periodically until cancelled """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.scan()
+        except asyncio.CancelledError:
+            pass